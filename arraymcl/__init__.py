@@ -0,0 +1,227 @@
+import math
+import numpy as np
+
+from .kld import KLDSampling
+from .likelihood import LikelihoodField
+from .stacked import StackedMCL
+
+class Particle:
+
+    def __init__(self, mcl, index):
+        self.mcl = mcl;
+        self.index = index;
+
+    def get_position(self):
+        return tuple(self.mcl.positions[self.index]);
+
+    def set_position(self, position):
+        self.mcl.positions[self.index] = position;
+        self.mcl.version += 1;
+
+    def get_orientation_offset(self):
+        return [self.mcl.orientation_offsets[self.index]];
+
+    def set_orientation_offset(self, orientation_offset):
+        self.mcl.orientation_offsets[self.index] = orientation_offset[0];
+        self.mcl.version += 1;
+
+    def get_weight(self):
+        return self.mcl.weights[self.index];
+
+class ArrayMCL:
+
+    STATE_ATTRIBUTES = ['dims', 'rotation_error', 'translation_magnitude_error', 'translation_direction_error', 'sigma',
+                        'weight_floor', 'resample_noise', 'recovery_rates', 'likelihood_slow', 'likelihood_fast', 'injected',
+                        'resample_policy', 'resample_threshold', 'resample_interval', 'resample_method', 'observation_count',
+                        'resample_count', 'observations_since_resample', 'likelihood_mode', 'likelihood_resolution', 'version',
+                        'positions', 'orientation_offsets', 'weights'];
+    SAMPLER_ATTRIBUTES = ['min_count', 'max_count', 'epsilon', 'delta', 'bin_size', 'angle_bin_size'];
+
+    def __init__(self, count, dims, rotation_error=0.5, translation_magnitude_error=0.05, translation_direction_error=2.0,
+                 sigma=40.0, weight_floor=1e-3, resample_noise=2.0, sampler=None, recovery_rates=None,
+                 resample_policy='ess', resample_threshold=0.2, resample_interval=1, resample_method='systematic',
+                 likelihood_mode='auto', likelihood_resolution=None, seed=None):
+        self.dims = tuple(dims);
+        self.rotation_error = rotation_error;
+        self.translation_magnitude_error = translation_magnitude_error;
+        self.translation_direction_error = translation_direction_error;
+        self.sigma = float(sigma);
+        self.weight_floor = weight_floor;
+        self.resample_noise = resample_noise;
+        self.sampler = sampler;
+        self.recovery_rates = recovery_rates;
+        self.likelihood_slow = None;
+        self.likelihood_fast = None;
+        self.injected = 0;
+        self.resample_policy = resample_policy;
+        self.resample_threshold = resample_threshold;
+        self.resample_interval = resample_interval;
+        self.resample_method = resample_method;
+        self.observation_count = 0;
+        self.resample_count = 0;
+        self.observations_since_resample = 0;
+        self.likelihood_mode = likelihood_mode;
+        self.likelihood_resolution = likelihood_resolution;
+        self.likelihood_field = None;
+        self.random = np.random.RandomState(seed);
+        self.version = 0;
+        self.positions = self.random.rand(count, 2) * self.dims;
+        self.orientation_offsets = self.random.uniform(-180, 180, count);
+        self.weights = np.ones(count) / count;
+
+    def get_count(self):
+        return len(self.weights);
+
+    def get_particles(self):
+        return [Particle(self, i) for i in range(self.get_count())];
+
+    def get_positions(self):
+        return self.positions;
+
+    def set_positions(self, positions):
+        self.positions[:] = positions;
+        self.version += 1;
+
+    def get_orientation_offsets(self):
+        return self.orientation_offsets;
+
+    def set_orientation_offsets(self, orientation_offsets):
+        self.orientation_offsets[:] = orientation_offsets;
+        self.version += 1;
+
+    def get_weights(self):
+        return self.weights;
+
+    def get_max_weight(self):
+        return self.weights.max();
+
+    def get_min_weight(self):
+        return self.weights.min();
+
+    def translate(self, dx, dy):
+        count = self.get_count();
+        magnitude = math.hypot(dx, dy) * (1 + self.random.normal(0, self.translation_magnitude_error, count));
+        direction = (math.degrees(math.atan2(dy, dx)) - self.orientation_offsets
+                     + self.random.normal(0, self.translation_direction_error, count));
+        rads = np.radians(direction);
+        self.positions[:, 0] += magnitude * np.cos(rads);
+        self.positions[:, 1] += magnitude * np.sin(rads);
+        self.version += 1;
+
+    def rotate(self, rotation):
+        self.orientation_offsets += self.random.normal(0, self.rotation_error, self.get_count());
+        self.orientation_offsets[:] = (self.orientation_offsets + 180) % 360 - 180;
+        self.version += 1;
+
+    def update_weights(self, locations, chunk_size=256):
+        locations = np.asarray(locations, dtype=float).reshape(-1, 2);
+        if not len(locations):
+            return;
+        # Moves re-observe the same candidates, so the field is only rebuilt when they change
+        field = self.likelihood_field;
+        if field is None or not field.matches(locations, self.likelihood_mode):
+            field = self.likelihood_field = LikelihoodField(locations, self.likelihood_mode, self.sigma,
+                                                            self.likelihood_resolution, chunk_size);
+        distances = field.squared_distances(self.positions);
+        likelihood = np.exp(-distances / (2 * self.sigma ** 2));
+        self.update_likelihood_averages(np.dot(self.weights, likelihood) / self.weights.sum());
+        self.weights *= likelihood + self.weight_floor;
+        self.weights /= self.weights.sum();
+        self.observation_count += 1;
+        self.observations_since_resample += 1;
+        self.version += 1;
+
+    def observe(self, locations, resample=False):
+        # 'always' keeps the original order, resampling before the new observation is weighted; the other
+        # policies decide from the weights the observation leaves behind
+        if resample and self.resample_policy == 'always':
+            self.resample();
+            self.update_weights(locations);
+            return True;
+        self.update_weights(locations);
+        if resample:
+            return self.resample_if_needed();
+        return False;
+
+    def get_effective_sample_size(self):
+        return 1.0 / np.dot(self.weights, self.weights);
+
+    def needs_resample(self):
+        if self.resample_policy == 'ess':
+            return self.get_effective_sample_size() < self.resample_threshold * self.get_count();
+        if self.resample_policy == 'interval':
+            return self.observations_since_resample >= self.resample_interval;
+        return True;
+
+    def resample_if_needed(self):
+        if not self.needs_resample():
+            return False;
+        self.resample();
+        return True;
+
+    def resample(self, count=None):
+        if count is None:
+            count = self.get_count() if self.sampler is None else self.sampler.choose_count(self);
+        if self.resample_method == 'multinomial':
+            indices = self.random.choice(self.get_count(), count, p=self.weights);
+        else:
+            # Systematic (low-variance) resampling: one uniform offset and a single pass over the cumulative weights
+            cumulative = np.cumsum(self.weights);
+            indices = np.searchsorted(cumulative, (self.random.rand() + np.arange(count)) * (cumulative[-1] / count), side='right');
+            indices = np.minimum(indices, len(cumulative) - 1);
+        # Fancy indexing copies, so the set can change size without aliasing the old arrays
+        self.positions = self.positions[indices] + self.random.normal(0, self.resample_noise, (count, 2));
+        self.orientation_offsets = self.orientation_offsets[indices];
+        self.weights = np.full(count, 1.0 / count);
+        self.injected = self.random.binomial(count, self.get_injection_probability());
+        if self.injected:
+            self.positions[-self.injected:] = self.random.rand(self.injected, 2) * self.dims;
+            self.orientation_offsets[-self.injected:] = self.random.uniform(-180, 180, self.injected);
+        self.resample_count += 1;
+        self.observations_since_resample = 0;
+        self.version += 1;
+
+    def update_likelihood_averages(self, likelihood):
+        if self.recovery_rates is None:
+            return;
+        if self.likelihood_slow is None:
+            self.likelihood_slow = self.likelihood_fast = likelihood;
+            return;
+        slow, fast = self.recovery_rates;
+        self.likelihood_slow += slow * (likelihood - self.likelihood_slow);
+        self.likelihood_fast += fast * (likelihood - self.likelihood_fast);
+
+    def get_injection_probability(self):
+        # Augmented MCL: when recent observations fit much worse than the long-run average the filter has
+        # probably lost track (e.g. after a teleport), so part of the set is redrawn uniformly
+        if self.likelihood_slow is None or self.likelihood_slow <= 0:
+            return 0.0;
+        return max(0.0, 1 - self.likelihood_fast / self.likelihood_slow);
+
+    def get_state(self):
+        # Plain values and arrays only, so a trace can store the filter without pickling it
+        state = dict((name, getattr(self, name)) for name in ArrayMCL.STATE_ATTRIBUTES);
+        state['sampler'] = None if self.sampler is None else [getattr(self.sampler, name) for name in ArrayMCL.SAMPLER_ATTRIBUTES];
+        return state;
+
+    def set_state(self, state):
+        for name in ArrayMCL.STATE_ATTRIBUTES:
+            value = state[name];
+            setattr(self, name, value if value is None or np.ndim(value) else np.asarray(value).item());
+        self.dims = tuple(self.dims);
+        if self.recovery_rates is not None:
+            self.recovery_rates = tuple(self.recovery_rates);
+        sampler = state['sampler'];
+        self.sampler = None if sampler is None else KLDSampling(int(sampler[0]), int(sampler[1]), *sampler[2:]);
+        self.likelihood_field = None;
+
+    def get_estimate(self):
+        position = np.average(self.positions, axis=0, weights=self.weights);
+        rads = np.radians(self.orientation_offsets);
+        orientation_offset = math.degrees(math.atan2(np.dot(self.weights, np.sin(rads)),
+                                                     np.dot(self.weights, np.cos(rads))));
+        return tuple(position), orientation_offset;
+
+    def get_variance(self):
+        mean = np.average(self.positions, axis=0, weights=self.weights);
+        return float(np.dot(self.weights, ((self.positions - mean) ** 2).sum(axis=1)));
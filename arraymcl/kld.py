@@ -0,0 +1,78 @@
+import numpy as np
+from scipy.special import ndtri
+
+class KLDSampling:
+
+    def __init__(self, min_count=200, max_count=20000, epsilon=0.05, delta=0.01, bin_size=25.0, angle_bin_size=15.0):
+        self.min_count = min_count;
+        self.max_count = max_count;
+        self.epsilon = epsilon;
+        self.delta = delta;
+        self.bin_size = float(bin_size);
+        self.angle_bin_size = float(angle_bin_size);
+        self.z = ndtri(1 - delta);
+        self.last_count = None;
+        self.last_bins = 0;
+        self.last_decision = '--';
+
+    def get_required_count(self, bins):
+        # Fox's bound: enough samples that the KL divergence to the true posterior stays below epsilon with
+        # probability 1 - delta, given the number of occupied histogram bins
+        k = np.maximum(np.asarray(bins, dtype=float) - 1, 1);
+        a = 2 / (9 * k);
+        required = k / (2 * self.epsilon) * (1 - a + np.sqrt(a) * self.z) ** 3;
+        return np.where(np.asarray(bins) > 1, np.ceil(required), 0).astype(np.int64);
+
+    def get_bins(self, positions, orientation_offsets):
+        cells = np.column_stack((np.floor(positions / self.bin_size),
+                                 np.floor((orientation_offsets + 180) / self.angle_bin_size))).astype(np.int64);
+        cells -= cells.min(axis=0);
+        extent = cells.max(axis=0) + 1;
+        return (cells[:, 0] * extent[1] + cells[:, 1]) * extent[2] + cells[:, 2];
+
+    def choose_count(self, mcl):
+        # Draws ancestors one batch at a time and stops at the first prefix that satisfies the bound, which
+        # gives the same count as sampling particle by particle
+        cumulative = np.cumsum(mcl.get_weights());
+        cumulative /= cumulative[-1];
+        drawn = np.zeros(0, dtype=np.int64);
+        size = self.min_count;
+        while True:
+            batch = np.searchsorted(cumulative, mcl.random.rand(size), side='right');
+            drawn = np.concatenate((drawn, np.minimum(batch, len(cumulative) - 1)));
+            keys = self.get_bins(mcl.positions[drawn], mcl.orientation_offsets[drawn]);
+            _, first = np.unique(keys, return_index=True);
+            new = np.zeros(len(drawn), dtype=bool);
+            new[first] = True;
+            bins = np.cumsum(new);
+            required = np.maximum(self.get_required_count(bins), self.min_count);
+            satisfied = np.nonzero(np.arange(1, len(drawn) + 1) >= required)[0];
+            if len(satisfied):
+                count = satisfied[0] + 1;
+                break;
+            if len(drawn) >= self.max_count:
+                count = self.max_count;
+                break;
+            size = min(len(drawn), self.max_count - len(drawn));
+        self.record(mcl.get_count(), count, bins[count - 1]);
+        return count;
+
+    def record(self, old_count, count, bins):
+        if count >= self.max_count:
+            decision = 'max';
+        elif count <= self.min_count:
+            decision = 'min';
+        elif count > old_count:
+            decision = 'grow';
+        elif count < old_count:
+            decision = 'shrink';
+        else:
+            decision = 'steady';
+        self.last_count = old_count;
+        self.last_bins = int(bins);
+        self.last_decision = decision;
+
+    def get_decision(self):
+        if self.last_count is None:
+            return 'KLD --';
+        return 'KLD ' + self.last_decision + ' from ' + str(self.last_count) + ', ' + str(self.last_bins) + ' bins';
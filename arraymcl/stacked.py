@@ -0,0 +1,158 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+from .likelihood import BRUTE_FORCE_CANDIDATES
+
+class StackedMCL:
+
+    STATE_ATTRIBUTES = ['dims', 'rotation_error', 'translation_magnitude_error', 'translation_direction_error', 'sigma',
+                        'weight_floor', 'resample_noise', 'resample_threshold', 'observation_counts', 'resample_counts',
+                        'version', 'positions', 'orientation_offsets', 'weights'];
+
+    # One fixed-size particle set per agent, stored as (agents, count) arrays so that every agent is moved,
+    # weighted and resampled in the same vectorized call. Set sizes are fixed (no KLD sampling or injection)
+    # to keep the arrays rectangular.
+    def __init__(self, agents, count, dims, rotation_error=0.5, translation_magnitude_error=0.05, translation_direction_error=2.0,
+                 sigma=40.0, weight_floor=1e-3, resample_noise=2.0, resample_threshold=0.5, seed=None):
+        self.dims = tuple(dims);
+        self.rotation_error = rotation_error;
+        self.translation_magnitude_error = translation_magnitude_error;
+        self.translation_direction_error = translation_direction_error;
+        self.sigma = float(sigma);
+        self.weight_floor = weight_floor;
+        self.resample_noise = resample_noise;
+        self.resample_threshold = resample_threshold;
+        self.observation_counts = np.zeros(agents, dtype=np.int64);
+        self.resample_counts = np.zeros(agents, dtype=np.int64);
+        self.random = np.random.RandomState(seed);
+        self.version = 0;
+        self.positions = self.random.rand(agents, count, 2) * self.dims;
+        self.orientation_offsets = self.random.uniform(-180, 180, (agents, count));
+        self.weights = np.ones((agents, count)) / count;
+
+    def get_agent_count(self):
+        return self.weights.shape[0];
+
+    def get_count(self):
+        return self.weights.shape[1];
+
+    def get_positions(self):
+        return self.positions;
+
+    def get_orientation_offsets(self):
+        return self.orientation_offsets;
+
+    def get_weights(self):
+        return self.weights;
+
+    def translate(self, translations):
+        translations = np.asarray(translations, dtype=float).reshape(-1, 2);
+        moving = np.nonzero((translations != 0).any(axis=1))[0];
+        if not len(moving):
+            return;
+        shape = (len(moving), self.get_count());
+        dx, dy = translations[moving, 0:1], translations[moving, 1:2];
+        magnitude = np.hypot(dx, dy) * (1 + self.random.normal(0, self.translation_magnitude_error, shape));
+        direction = (np.degrees(np.arctan2(dy, dx)) - self.orientation_offsets[moving]
+                     + self.random.normal(0, self.translation_direction_error, shape));
+        rads = np.radians(direction);
+        self.positions[moving, :, 0] += magnitude * np.cos(rads);
+        self.positions[moving, :, 1] += magnitude * np.sin(rads);
+        self.version += 1;
+
+    def rotate(self, rotations):
+        rotating = np.nonzero(np.asarray(rotations) != 0)[0];
+        if not len(rotating):
+            return;
+        offsets = self.orientation_offsets[rotating] + self.random.normal(0, self.rotation_error, (len(rotating), self.get_count()));
+        self.orientation_offsets[rotating] = (offsets + 180) % 360 - 180;
+        self.version += 1;
+
+    def get_squared_distances(self, agents, locations, observed):
+        order = np.argsort(agents, kind='mergesort');
+        agents, locations = agents[order], locations[order];
+        first = np.searchsorted(agents, observed);
+        counts = np.searchsorted(agents, observed, side='right') - first;
+        if counts.max() <= BRUTE_FORCE_CANDIDATES:
+            # Few candidates per agent (the usual case): pad every agent's list to the same length with
+            # unreachable points and take all minimums in one broadcast
+            rows = np.repeat(np.arange(len(observed)), counts);
+            padded = np.full((len(observed), counts.max(), 2), np.inf);
+            padded[rows, np.arange(len(agents)) - first[rows]] = locations;
+            diff = self.positions[observed][:, :, np.newaxis, :] - padded[:, np.newaxis, :, :];
+            return np.einsum('ancj,ancj->anc', diff, diff).min(axis=2);
+        # Each agent's candidates are shifted into their own band along x so one kd-tree answers every agent's
+        # nearest-candidate query; the rare particle that strays far enough to reach another band is redone
+        # against its own candidates
+        spacing = 2.0 * (self.dims[0] + self.dims[1]);
+        tree = cKDTree(locations + np.column_stack((agents * spacing, np.zeros(len(agents)))));
+        positions = self.positions[observed].copy();
+        positions[:, :, 0] += observed[:, np.newaxis] * spacing;
+        distances, nearest = tree.query(positions.reshape(-1, 2));
+        distances = distances.reshape(len(observed), -1) ** 2;
+        stray_rows, stray_columns = np.nonzero(agents[nearest.reshape(len(observed), -1)] != observed[:, np.newaxis]);
+        for row, column in zip(stray_rows, stray_columns):
+            own = locations[agents == observed[row]];
+            distances[row, column] = ((own - self.positions[observed[row], column]) ** 2).sum(axis=1).min();
+        return distances;
+
+    def update_weights(self, agents, locations):
+        agents = np.asarray(agents, dtype=np.int64).ravel();
+        locations = np.asarray(locations, dtype=float).reshape(-1, 2);
+        if not len(locations):
+            return np.zeros(0, dtype=np.int64);
+        observed = np.unique(agents);
+        likelihood = np.exp(-self.get_squared_distances(agents, locations, observed) / (2 * self.sigma ** 2));
+        weights = self.weights[observed] * (likelihood + self.weight_floor);
+        self.weights[observed] = weights / weights.sum(axis=1)[:, np.newaxis];
+        self.observation_counts[observed] += 1;
+        self.version += 1;
+        return observed;
+
+    def get_effective_sample_sizes(self):
+        return 1.0 / (self.weights ** 2).sum(axis=1);
+
+    def resample_if_needed(self, agents=None):
+        agents = np.arange(self.get_agent_count()) if agents is None else np.asarray(agents, dtype=np.int64);
+        agents = agents[self.get_effective_sample_sizes()[agents] < self.resample_threshold * self.get_count()];
+        if len(agents):
+            self.resample(agents);
+        return agents;
+
+    def resample(self, agents=None):
+        agents = np.arange(self.get_agent_count()) if agents is None else np.asarray(agents, dtype=np.int64);
+        count = self.get_count();
+        # Systematic resampling for all rows at once: offsetting row r's normalized cumulative weights into
+        # (r, r + 1] turns the per-row searches into a single searchsorted over the flattened array
+        rows = np.arange(len(agents))[:, np.newaxis];
+        cumulative = np.cumsum(self.weights[agents], axis=1);
+        cumulative = cumulative / cumulative[:, -1:] + rows;
+        targets = rows + (self.random.rand(len(agents), 1) + np.arange(count)) / count;
+        indices = np.searchsorted(cumulative.ravel(), targets.ravel(), side='right').reshape(len(agents), count) - rows * count;
+        indices = np.clip(indices, 0, count - 1);
+        self.positions[agents] = (self.positions[agents[:, np.newaxis], indices]
+                                  + self.random.normal(0, self.resample_noise, (len(agents), count, 2)));
+        self.orientation_offsets[agents] = self.orientation_offsets[agents[:, np.newaxis], indices];
+        self.weights[agents] = 1.0 / count;
+        self.resample_counts[agents] += 1;
+        self.version += 1;
+
+    def get_state(self):
+        return dict((name, getattr(self, name)) for name in StackedMCL.STATE_ATTRIBUTES);
+
+    def set_state(self, state):
+        for name in StackedMCL.STATE_ATTRIBUTES:
+            value = state[name];
+            setattr(self, name, np.array(value) if np.ndim(value) else np.asarray(value).item());
+        self.dims = tuple(self.dims);
+
+    def get_estimates(self):
+        positions = np.einsum('an,anj->aj', self.weights, self.positions);
+        rads = np.radians(self.orientation_offsets);
+        orientation_offsets = np.degrees(np.arctan2((self.weights * np.sin(rads)).sum(axis=1),
+                                                    (self.weights * np.cos(rads)).sum(axis=1)));
+        return positions, orientation_offsets;
+
+    def get_variances(self):
+        means = np.einsum('an,anj->aj', self.weights, self.positions);
+        return (self.weights * ((self.positions - means[:, np.newaxis, :]) ** 2).sum(axis=2)).sum(axis=1);
@@ -0,0 +1,32 @@
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'));
+
+from arraymcl.likelihood import LikelihoodField
+
+def main():
+    sigma = 40.0;
+    random = np.random.RandomState(0);
+    print '%10s %11s %8s %12s %12s %18s' % ('particles', 'candidates', 'mode', 'build ms', 'lookup ms', 'max likelihood err');
+    for particles in [1000, 10000, 100000]:
+        for candidates in [10, 100, 1000]:
+            positions = random.rand(particles, 2) * 4000;
+            locations = random.rand(candidates, 2) * 4000;
+            reference = None;
+            for mode in ['brute', 'kdtree', 'grid']:
+                start = time.time();
+                field = LikelihoodField(locations, mode, sigma);
+                built = time.time();
+                distances = field.squared_distances(positions);
+                done = time.time();
+                likelihood = np.exp(-distances / (2 * sigma ** 2));
+                if reference is None:
+                    reference = likelihood;
+                print '%10d %11d %8s %12.2f %12.2f %18.2e' % (particles, candidates, field.mode, (built - start) * 1000,
+                                                             (done - built) * 1000, np.abs(likelihood - reference).max());
+
+if __name__ == '__main__':
+    main();
@@ -0,0 +1,48 @@
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'));
+
+from locationencodingmodel import RandomModel
+from mcl_simulation import MCLSimulation
+from multi_agent_simulation import MultiAgentSimulation
+
+MOVES = [['w'], ['d'], ['s'], ['a']];
+
+def bench_independent(model, agents, particles, steps):
+    # One single-agent simulation per agent; headless runs skip the mixture fit the fleet has no counterpart for
+    sims = [MCLSimulation(1000, 800, headless=True, location_encoding_model=model, particle_count=particles,
+                          adaptive_particles=False, recovery_rates=None) for _ in range(agents)];
+    random = np.random.RandomState(0);
+    for sim in sims:
+        sim.location = tuple(100 + random.rand(2) * (800, 600));
+        sim.update_visible();
+    start = time.time();
+    for step in range(steps):
+        for i, sim in enumerate(sims):
+            sim.step(MOVES[(step // 5 + i) % 4]);
+    return (time.time() - start) / steps * 1000;
+
+def bench_batched(model, agents, particles, steps):
+    sim = MultiAgentSimulation(1000, 800, headless=True, location_encoding_model=model, agent_count=agents,
+                               particle_count=particles, seed=0);
+    start = time.time();
+    for step in range(steps):
+        sim.step(MOVES[(step // 5) % 4]);
+    return (time.time() - start) / steps * 1000;
+
+def main():
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 40;
+    model = RandomModel(25, 20, k=128, seed=0);
+    print '%8s %10s %16s %14s %18s %16s' % ('agents', 'particles', 'independent ms', 'batched ms', 'independent/agent', 'batched/agent');
+    for agents in [1, 4, 16, 64]:
+        for particles in [200, 1000]:
+            independent = bench_independent(model, agents, particles, steps);
+            batched = bench_batched(model, agents, particles, steps);
+            print '%8d %10d %16.2f %14.2f %18.3f %16.3f' % (agents, particles, independent, batched,
+                                                            independent / agents, batched / agents);
+
+if __name__ == '__main__':
+    main();
@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'));
+
+from arraymcl import ArrayMCL
+from mcl_simulation import MCLSimulation
+
+TRAJECTORY = [['d']] * 10 + [['s']] * 10 + [['a']] * 10 + [['w']] * 10 + [['q', 'd']] * 10 + [['e', 's']] * 10;
+
+def bench_methods(repeats):
+    print '%10s %16s %16s' % ('particles', 'multinomial ms', 'systematic ms');
+    for count in [1000, 10000, 100000]:
+        times = [];
+        for method in ['multinomial', 'systematic']:
+            mcl = ArrayMCL(count, (40000, 40000), resample_method=method, seed=0);
+            mcl.weights = mcl.random.rand(count);
+            mcl.weights /= mcl.weights.sum();
+            start = time.time();
+            for _ in range(repeats):
+                mcl.resample();
+            times.append((time.time() - start) / repeats * 1000);
+        print '%10d %16.2f %16.2f' % (count, times[0], times[1]);
+
+def run_policy(seed, **kwargs):
+    sim = MCLSimulation(1000, 800, headless=True, adaptive_particles=False, recovery_rates=None, seed=seed, mcl_seed=seed, **kwargs);
+    resample = sim.mcl.resample;
+    spent = [0.0];
+    def timed_resample(*args):
+        start = time.time();
+        resample(*args);
+        spent[0] += time.time() - start;
+    sim.mcl.resample = timed_resample;
+    sim.update_visible();
+    errors = [];
+    for keysyms in TRAJECTORY:
+        sim.step(keysyms);
+        errors.append(np.hypot(*(np.array(sim.mcl.get_estimate()[0]) - sim.location)));
+    return sim.mcl.resample_count, sim.mcl.observation_count, spent[0] * 1000, np.mean(errors[len(errors) / 2:]);
+
+def main():
+    seeds = int(sys.argv[1]) if len(sys.argv) > 1 else 40;
+    bench_methods(20);
+    print;
+    # Every policy runs the same seeds, so each one's error is also compared seed by seed against 'always'
+    print '%-22s %12s %14s %14s %10s %18s %8s' % ('policy', 'resamples', 'observations', 'resample ms', 'error',
+                                                  'vs always', 'worse');
+    baseline = None;
+    for name, kwargs in [('always, resample first', {'resample_policy': 'always'}),
+                         ('ess 0.2 (default)', {'resample_policy': 'ess', 'resample_threshold': 0.2}),
+                         ('ess 0.3', {'resample_policy': 'ess', 'resample_threshold': 0.3}),
+                         ('ess 0.5', {'resample_policy': 'ess', 'resample_threshold': 0.5}),
+                         ('every 3 observations', {'resample_policy': 'interval', 'resample_interval': 3})]:
+        results = np.array([run_policy(seed, **kwargs) for seed in range(seeds)]);
+        if baseline is None:
+            baseline = results[:, 3];
+        difference = results[:, 3] - baseline;
+        resamples, observations, spent, error = results.mean(axis=0);
+        print '%-22s %12.1f %14.1f %14.2f %10.1f %10.1f +- %4.1f %7.0f%%' % (name, resamples, observations, spent, error,
+                                                                       difference.mean(), difference.std() / np.sqrt(seeds),
+                                                                       100.0 * (difference > 0).mean());
+
+if __name__ == '__main__':
+    main();
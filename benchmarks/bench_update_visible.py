@@ -0,0 +1,66 @@
+import os
+import sys
+import math
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'));
+
+from camera_simulation import CameraSimulation
+
+class BenchmarkCameraSimulation(CameraSimulation):
+    
+    def on_view(self, changed):
+        pass;
+
+def reference_visible(sim):
+    visible = set();
+    vs = sim.view_size / 2 * 1.5;
+    transformed = sim.rotate_transform(sim.location[0], sim.location[1], rotation=sim.orientation);
+    x, y = sim.location;
+    s = sim.view_size / 2 * math.sqrt(2);
+    low_i = max(0, int(math.floor(float(x - s) / CameraSimulation.CELL_SIZE)));
+    high_i = min(int(math.ceil(float(x + s) / CameraSimulation.CELL_SIZE)), sim.grid_width - 1);
+    low_j = max(0, int(math.floor(float(y - s) / CameraSimulation.CELL_SIZE)));
+    high_j = min(int(math.ceil(float(y + s) / CameraSimulation.CELL_SIZE)), sim.grid_height - 1);
+    for i in range(low_i, high_i + 1):
+        for j in range(low_j, high_j + 1):
+            tl = (float(sim.width)/sim.grid_width*(i), float(sim.height)/sim.grid_height*(j));
+            tr = (tl[0] + CameraSimulation.CELL_SIZE, tl[1]);
+            br = (tl[0] + CameraSimulation.CELL_SIZE, tl[1] + CameraSimulation.CELL_SIZE);
+            bl = (tl[0], tl[1] + CameraSimulation.CELL_SIZE);
+            bounds = map(lambda x: sim.rotate_transform(x[0], x[1], rotation=sim.orientation), [tl, tr, br, bl]);
+            xs = map(lambda x: x[0], bounds);
+            ys = map(lambda x: x[1], bounds);
+            if min(xs) >= transformed[0] - vs and max(xs) < transformed[0] + vs and min(ys) >= transformed[1] - vs and max(ys) < transformed[1] + vs:
+                visible.add((i, j));
+    return visible;
+
+def bench(sim, steps, update):
+    start = time.time();
+    for step in range(steps):
+        sim.location = (sim.location[0] + 7, sim.location[1] + 3);
+        update();
+    return (time.time() - start) / steps * 1000;
+
+def main():
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 20;
+    sim = BenchmarkCameraSimulation(40000, 40000, headless=True);
+    print '%10s %12s %10s %14s %14s %14s' % ('view size', 'orientation', 'visible', 'reference ms', 'full ms', 'translate ms');
+    for view_size in [60, 200, 600, 1200, 2400]:
+        for orientation in [0, 15, 45]:
+            sim.view_size = view_size;
+            sim.orientation = orientation;
+            sim.location = (20000, 20000);
+            sim.update_visible();
+            assert sim.visible == reference_visible(sim);
+            reference = bench(sim, max(1, steps / max(1, view_size / 200)), lambda: reference_visible(sim));
+            def full():
+                sim.visible_cache = None;
+                sim.update_visible();
+            full_time = bench(sim, steps, full);
+            translate_time = bench(sim, steps, sim.update_visible);
+            assert sim.visible == reference_visible(sim);
+            print '%10d %12d %10d %14.2f %14.2f %14.2f' % (view_size, orientation, len(sim.visible), reference, full_time, translate_time);
+
+if __name__ == '__main__':
+    main();
@@ -0,0 +1,188 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import warnings
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'));
+
+from locationencodingmodel import RandomModel, ModuloModel
+from camera_simulation import CameraSimulation
+from observation_simulation import ObservationSimulation
+from mcl_simulation import MCLSimulation
+from arraymcl import ArrayMCL
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json');
+
+class QuietCameraSimulation(CameraSimulation):
+    
+    def on_view(self, changed):
+        pass;
+
+def measure(function, repeats, setup=None):
+    # Median of the repeats, in milliseconds, so one scheduler hiccup does not move the baseline
+    times = [];
+    for _ in range(repeats):
+        if setup is not None:
+            setup();
+        start = time.time();
+        function();
+        times.append(time.time() - start);
+    return float(np.median(times)) * 1000;
+
+def walk(sim, step):
+    sim.location = ((sim.location[0] + 7 * step) % (sim.width - 200) + 100, (sim.location[1] + 3 * step) % (sim.height - 200) + 100);
+
+def bench_model_construction(scale):
+    for model_type in [RandomModel, ModuloModel]:
+        for grid in [int(g * scale) for g in [100, 300, 1000]]:
+            for k in [32, 128]:
+                yield {'model': model_type.__name__, 'grid': grid, 'k': k}, measure(lambda: model_type(grid, grid, k=k), 3);
+
+def bench_update_visible(scale):
+    for grid in [int(g * scale) for g in [100, 1000]]:
+        sim = QuietCameraSimulation(grid * CameraSimulation.CELL_SIZE, grid * CameraSimulation.CELL_SIZE, headless=True);
+        for view_size in [60, 200, 600, 1200]:
+            sim.view_size = view_size;
+            sim.orientation = 15;
+            sim.location = (sim.width / 2, sim.height / 2);
+            sim.visible_cache = None;
+            steps = [0];
+            def update():
+                steps[0] += 1;
+                walk(sim, steps[0]);
+                sim.update_visible();
+            yield {'grid': grid, 'view': view_size}, measure(update, 20);
+
+def bench_on_view(scale):
+    for grid in [int(g * scale) for g in [100, 1000]]:
+        for k in [32, 128]:
+            sim = ObservationSimulation(grid * CameraSimulation.CELL_SIZE, grid * CameraSimulation.CELL_SIZE, headless=True, k=k, seed=0);
+            for view_size in [60, 200]:
+                sim.view_size = view_size;
+                sim.location = (sim.width / 2, sim.height / 2);
+                steps = [0];
+                def setup():
+                    steps[0] += 1;
+                    walk(sim, steps[0]);
+                    sim.visible = set(map(tuple, sim.compute_visible().tolist()));
+                yield {'grid': grid, 'k': k, 'view': view_size}, measure(lambda: sim.on_view(True), 10, setup);
+
+def bench_update_gaussians(scale):
+    sim = MCLSimulation(1000, 800, headless=True, seed=0);
+    for incremental in [True, False]:
+        sim.incremental_mixture = incremental;
+        for particles in [int(p * scale) for p in [1000, 10000]]:
+            sim.mcl = ArrayMCL(particles, (sim.width, sim.height), seed=0);
+            sim.mixture_model = None;
+            sim.mixture_skips = 0;
+            yield ({'incremental': incremental, 'particles': particles},
+                   measure(sim.update_gaussians, 5, lambda: sim.mcl.translate(3, 1)));
+
+def bench_mcl_cycle(scale):
+    for particles in [int(p * scale) for p in [1000, 10000, 100000]]:
+        for locations in [10, 100, 1000]:
+            mcl = ArrayMCL(particles, (40000, 40000), seed=0);
+            candidates = np.random.RandomState(0).rand(locations, 2) * 40000;
+            def cycle():
+                mcl.translate(7, 3);
+                mcl.update_weights(candidates);
+                mcl.resample();
+            yield {'particles': particles, 'locations': locations}, measure(cycle, 5);
+
+def bench_render(scale):
+    for grid in sorted(set([25, max(25, int(250 * scale))])):
+        sim = MCLSimulation(grid * CameraSimulation.CELL_SIZE, int(grid * 0.8) * CameraSimulation.CELL_SIZE, headless=True, seed=0);
+        sim.init_offscreen_canvas();
+        sim.view_data = True;
+        sim.update_visible();
+        for particles in [int(p * scale) for p in [1000, 10000]]:
+            sim.mcl = ArrayMCL(particles, (sim.width, sim.height), seed=0);
+            for density in [True, False]:
+                sim.density_particles = density;
+                steps = [0];
+                def setup():
+                    steps[0] += 1;
+                    sim.key_event(['Left'] if steps[0] % 2 else ['Right']);
+                yield {'grid': grid, 'particles': particles, 'density': density, 'stage': 'frame'}, measure(sim.render_frame, 5, setup);
+                yield {'grid': grid, 'particles': particles, 'density': density, 'stage': 'rasterize'}, measure(sim.canvas.rasterize, 3);
+
+SECTIONS = [('model_construction', bench_model_construction),
+            ('update_visible', bench_update_visible),
+            ('on_view', bench_on_view),
+            ('update_gaussians', bench_update_gaussians),
+            ('mcl_cycle', bench_mcl_cycle),
+            ('render', bench_render)];
+
+def case_name(section, params):
+    return section + '/' + ','.join(key + '=' + str(params[key]) for key in sorted(params));
+
+def scaling_exponent(rows, key):
+    # Mean slope of log(time) against log(parameter) over groups of rows that only differ in that parameter
+    groups = {};
+    for params, ms in rows:
+        value = params.get(key);
+        if isinstance(value, (int, long)) and not isinstance(value, bool) and value > 0 and ms > 0:
+            rest = tuple(sorted((name, other) for name, other in params.items() if name != key));
+            groups.setdefault(rest, []).append((value, ms));
+    slopes = [np.polyfit(np.log([x for x, _ in points]), np.log([y for _, y in points]), 1)[0]
+              for points in groups.values() if len(set(x for x, _ in points)) > 1];
+    return float(np.mean(slopes)) if slopes else None;
+
+def main():
+    parser = argparse.ArgumentParser(description='Scaling benchmarks for the localization pipeline');
+    parser.add_argument('sections', nargs='*', help='sections to run (default: all of ' + ', '.join(name for name, _ in SECTIONS) + ')');
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='JSON baseline to compare against');
+    parser.add_argument('--save', action='store_true', help='write the results as the new baseline');
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed slowdown ratio over the baseline');
+    parser.add_argument('--min-delta', type=float, default=0.5, help='ignore slowdowns smaller than this many ms');
+    parser.add_argument('--quick', action='store_true', help='shrink the sweeps for a smoke run');
+    args = parser.parse_args();
+    
+    scale = 0.1 if args.quick else 1.0;
+    warnings.simplefilter('ignore');
+    baseline = {};
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get('results', {});
+    
+    results = {};
+    regressions = [];
+    for section, bench in SECTIONS:
+        if args.sections and section not in args.sections:
+            continue;
+        print section;
+        rows = [];
+        for params, ms in bench(scale):
+            name = case_name(section, params);
+            results[name] = ms;
+            rows.append((params, ms));
+            previous = baseline.get(name);
+            note = '';
+            if previous is not None:
+                note = '%+.0f%%' % ((ms / previous - 1) * 100) if previous > 0 else '';
+                if ms > previous * (1 + args.tolerance) and ms - previous > args.min_delta:
+                    regressions.append((name, previous, ms));
+                    note += ' REGRESSION';
+            print '  %-60s %10.2f ms %s' % (name.split('/', 1)[1], ms, note);
+        for key in sorted(set(key for params, _ in rows for key in params)):
+            exponent = scaling_exponent(rows, key);
+            if exponent is not None:
+                print '  scaling with %s: O(n^%.2f)' % (key, exponent);
+    
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({'machine': platform.node(), 'python': platform.python_version(), 'numpy': np.__version__,
+                       'timestamp': int(time.time()), 'results': dict(baseline, **results)}, f, indent=2, sort_keys=True);
+        print 'Saved ' + str(len(results)) + ' results to ' + args.baseline;
+    if regressions:
+        print str(len(regressions)) + ' regressions against ' + args.baseline + ':';
+        for name, previous, ms in regressions:
+            print '  %s: %.2f ms -> %.2f ms' % (name, previous, ms);
+        sys.exit(1);
+
+if __name__ == '__main__':
+    main();
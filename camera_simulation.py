@@ -1,4 +1,5 @@
 import math
+import numpy as np
 
 from pannable_simulation import PannableSimulation
         
@@ -6,15 +7,18 @@ class CameraSimulation(PannableSimulation):
     
     VIEW_SIZE = 60; #100
     CELL_SIZE = 40; #40
+    VISIBLE_SLACK_EPSILON = 1e-6;
+    MIN_GRID_SPACING = 4;
     
-    def __init__(self, width, height, rotation=0, title='Simulation'):
-        PannableSimulation.__init__(self, width, height, rotation, title=title);
+    def __init__(self, width, height, rotation=0, title='Simulation', headless=False, retained=True):
+        PannableSimulation.__init__(self, width, height, rotation, title=title, headless=headless, retained=retained);
         self.location = (550, 450);
         self.orientation = -rotation;
         self.view_size = CameraSimulation.VIEW_SIZE;
         self.grid_width = width / CameraSimulation.CELL_SIZE;
         self.grid_height = height / CameraSimulation.CELL_SIZE;
         self.visible = set();
+        self.visible_cache = None;
         self.keep_centered = False;
         
     def loop(self):
@@ -26,9 +30,11 @@ class CameraSimulation(PannableSimulation):
     def pre_render(self):
         PannableSimulation.pre_render(self);
         
+        self.set_layer('camera');
         points = self.get_world_coordinates();
-        self.draw_polygon(*(points + [points[0]]), fill='#1294fc', width=2);
+        self.draw_polygon(np.vstack((points, points[:1])), fill='#1294fc', width=2);
         
+        self.set_layer('visible');
         for i, j in self.visible:
             tl = (float(self.width)/self.grid_width*(i),
                   float(self.height)/self.grid_height*(j));
@@ -41,30 +47,63 @@ class CameraSimulation(PannableSimulation):
     def render(self):
         PannableSimulation.render(self);
         
-        points = self.get_world_coordinates();
         self.draw_grid();
             
     def done_rendering(self):
+        self.set_layer('camera_outline');
         points = self.get_world_coordinates();
-        self.draw_polygon(*(points + [points[0]]), width=2);
+        self.draw_polygon(np.vstack((points, points[:1])), width=2);
         PannableSimulation.done_rendering(self);
                     
     def draw_grid(self):
-        for i in range(self.grid_width - 1):
-            self.draw_line(float(self.width)/self.grid_width*(i+1), 0, float(self.width)/self.grid_width*(i+1), self.height, outline='black', dash=(1, 5));
-        for i in range(self.grid_height - 1):
-            self.draw_line(0, float(self.height)/self.grid_height*(i+1), self.width, float(self.height)/self.grid_height*(i+1), outline='black', dash=(1, 5));
+        mode = self.begin_static_layer('grid', (self.grid_width, self.grid_height));
+        if mode == 'keep':
+            return;
+        cell_width = float(self.width)/self.grid_width;
+        cell_height = float(self.height)/self.grid_height;
+        if min(cell_width, cell_height) * self.get_view_scale() < CameraSimulation.MIN_GRID_SPACING:
+            # Zoomed out over a large world the lines would merge into solid fill, one canvas item per cell row
+            return;
+        low_x, low_y, high_x, high_y = self.get_view_bounds();
+        columns = np.arange(max(1, int(math.ceil(low_x / cell_width))), min(self.grid_width - 1, int(math.floor(high_x / cell_width))) + 1);
+        rows = np.arange(max(1, int(math.ceil(low_y / cell_height))), min(self.grid_height - 1, int(math.floor(high_y / cell_height))) + 1);
+        keys = [('column', i) for i in columns.tolist()] + [('row', j) for j in rows.tolist()];
+        starts = np.vstack((np.column_stack((columns * cell_width, np.zeros(len(columns)))),
+                            np.column_stack((np.zeros(len(rows)), rows * cell_height))));
+        ends = np.vstack((np.column_stack((columns * cell_width, np.full(len(columns), float(self.height)))),
+                          np.column_stack((np.full(len(rows), float(self.width)), rows * cell_height))));
+        draw = self.get_static_mask(mode, keys);
+        self.draw_lines(starts[draw], ends[draw], keys=[key for key, d in zip(keys, draw) if d], outline='black', dash=(1, 5));
+    
+    def get_cells_in_view(self):
+        cell_width = float(self.width)/self.grid_width;
+        cell_height = float(self.height)/self.grid_height;
+        low_x, low_y, high_x, high_y = self.get_view_bounds();
+        i = np.arange(max(0, int(math.floor(low_x / cell_width))), min(self.grid_width, int(math.floor(high_x / cell_width)) + 1));
+        j = np.arange(max(0, int(math.floor(low_y / cell_height))), min(self.grid_height, int(math.floor(high_y / cell_height)) + 1));
+        return np.column_stack((np.repeat(i, len(j)), np.tile(j, len(i))));
+        
+    def get_cell_corners(self, cells):
+        cells = np.asarray(cells).reshape(-1, 2);
+        tl = np.column_stack((float(self.width)/self.grid_width*cells[:, 0], float(self.height)/self.grid_height*cells[:, 1]));
+        offsets = np.array([(0, 0), (1, 0), (1, 1), (0, 1)]) * CameraSimulation.CELL_SIZE;
+        return tl[:, np.newaxis, :] + offsets[np.newaxis, :, :];
+    
+    def get_cell_centers(self, cells):
+        return self.get_cell_corners(cells)[:, 0, :] + CameraSimulation.CELL_SIZE / 2;
         
     def get_world_coordinates(self):
         x, y = self.location;
         s = self.view_size / 2;
         points = [(x - s, y - s), (x + s, y - s), (x + s, y + s), (x - s, y + s)];
-        points = map(lambda x: self.rotate_transform(x[0], x[1], rotation=self.orientation, about=self.location), points);
-        return points;
+        return self.rotate_points(points, rotation=self.orientation, about=self.location);
     
     def update_visible(self):
-        old_visible = set(self.visible);
-        self.visible = set();
+        old_visible = self.visible;
+        self.visible = set(map(tuple, self.compute_visible().tolist()));
+        self.on_view(self.visible != old_visible);
+        
+    def compute_visible(self):
         vs = self.view_size / 2 * 1.5;
         transformed = self.rotate_transform(self.location[0], self.location[1], rotation=self.orientation);
         x, y = self.location;
@@ -73,20 +112,83 @@ class CameraSimulation(PannableSimulation):
         high_i = min(int(math.ceil(float(x + s) / CameraSimulation.CELL_SIZE)), self.grid_width - 1);
         low_j = max(0, int(math.floor(float(y - s) / CameraSimulation.CELL_SIZE)));
         high_j = min(int(math.ceil(float(y + s) / CameraSimulation.CELL_SIZE)), self.grid_height - 1);
+        key = (self.orientation, vs, self.grid_width, self.grid_height);
         
-        for i in range(low_i, high_i + 1):
-            for j in range(low_j, high_j + 1):
-                tl = (float(self.width)/self.grid_width*(i), float(self.height)/self.grid_height*(j));
-                tr = (tl[0] + CameraSimulation.CELL_SIZE, tl[1]);
-                br = (tl[0] + CameraSimulation.CELL_SIZE, tl[1] + CameraSimulation.CELL_SIZE);
-                bl = (tl[0], tl[1] + CameraSimulation.CELL_SIZE);
-                bounds = map(lambda x: self.rotate_transform(x[0], x[1], rotation=self.orientation), [tl, tr, br, bl]);
-                xs = map(lambda x: x[0], bounds);
-                ys = map(lambda x: x[1], bounds);
-                if min(xs) >= transformed[0] - vs and max(xs) < transformed[0] + vs and min(ys) >= transformed[1] - vs and max(ys) < transformed[1] + vs:
-                    self.visible.add((i, j));
+        # Cells whose corners clear the old view bounds by more than the shift stay visible after a pure translation
+        keep = np.zeros((0, 2), dtype=np.int64);
+        keep_extents = np.zeros((0, 4));
+        cache = self.visible_cache;
+        if cache is not None and cache['key'] == key and len(cache['cells']):
+            shift = max(abs(transformed[0] - cache['center'][0]), abs(transformed[1] - cache['center'][1]));
+            cells, extents = cache['cells'], cache['extents'];
+            slack = np.minimum(*self.get_view_margins(extents, cache['center'], vs));
+            inside = ((cells[:, 0] >= low_i) & (cells[:, 0] <= high_i) & (cells[:, 1] >= low_j) & (cells[:, 1] <= high_j)
+                      & (slack > shift + CameraSimulation.VISIBLE_SLACK_EPSILON));
+            keep, keep_extents = cells[inside], extents[inside];
         
-        self.on_view(self.visible != old_visible);
+        untested = np.ones((max(0, high_i - low_i + 1), max(0, high_j - low_j + 1)), dtype=bool);
+        untested[keep[:, 0] - low_i, keep[:, 1] - low_j] = False;
+        ii, jj = np.nonzero(untested);
+        candidates = np.column_stack((ii + low_i, jj + low_j));
+        extents = self.get_cell_extents(candidates);
+        low, high = self.get_view_margins(extents, transformed, vs);
+        visible = (low >= 0) & (high > 0);
+        
+        cells = np.concatenate((keep, candidates[visible]));
+        extents = np.concatenate((keep_extents, extents[visible]));
+        self.visible_cache = {'key': key, 'center': transformed, 'cells': cells, 'extents': extents};
+        return cells;
+    
+    def compute_visible_batch(self, locations, orientations):
+        # Same test as compute_visible for many cameras at once: every camera checks an equally sized window of
+        # cells around itself, so all of them are tested in one vectorized pass. Returns the camera index and
+        # the cell of every visible (camera, cell) pair.
+        locations = np.asarray(locations, dtype=float).reshape(-1, 2);
+        rads = np.radians(np.asarray(orientations, dtype=float)).reshape(-1, 1);
+        cos, sin = np.cos(rads), np.sin(rads);
+        vs = self.view_size / 2 * 1.5;
+        s = self.view_size / 2 * math.sqrt(2);
+        about = np.array([self.width / 2.0, self.height / 2.0]);
+        cell_size = np.array([float(self.width)/self.grid_width, float(self.height)/self.grid_height]);
+        low = np.maximum(np.floor((locations - s) / CameraSimulation.CELL_SIZE), 0).astype(np.int64);
+        high = np.minimum(np.ceil((locations + s) / CameraSimulation.CELL_SIZE), (self.grid_width - 1, self.grid_height - 1)).astype(np.int64);
+        span = int(math.ceil(2 * s / CameraSimulation.CELL_SIZE)) + 2;
+        window = np.column_stack((np.repeat(np.arange(span), span), np.tile(np.arange(span), span)));
+        cells = low[:, np.newaxis, :] + window[np.newaxis, :, :];
+        inside = (cells <= high[:, np.newaxis, :]).all(axis=2);
+        
+        centers = locations - about;
+        centers = np.column_stack((centers[:, 0:1] * cos - centers[:, 1:2] * sin, centers[:, 0:1] * sin + centers[:, 1:2] * cos)) + about;
+        corners = cells * cell_size;
+        xs = np.stack((corners[:, :, 0], corners[:, :, 0] + CameraSimulation.CELL_SIZE), axis=2) - about[0];
+        ys = np.stack((corners[:, :, 1], corners[:, :, 1] + CameraSimulation.CELL_SIZE), axis=2) - about[1];
+        cos, sin = cos[:, :, np.newaxis, np.newaxis], sin[:, :, np.newaxis, np.newaxis];
+        us = (xs[:, :, :, np.newaxis] * cos + ys[:, :, np.newaxis, :] * -sin + about[0]).reshape(len(locations), -1, 4);
+        ws = (xs[:, :, :, np.newaxis] * sin + ys[:, :, np.newaxis, :] * cos + about[1]).reshape(len(locations), -1, 4);
+        low_margin = np.minimum(us.min(axis=2) - (centers[:, 0:1] - vs), ws.min(axis=2) - (centers[:, 1:2] - vs));
+        high_margin = np.minimum((centers[:, 0:1] + vs) - us.max(axis=2), (centers[:, 1:2] + vs) - ws.max(axis=2));
+        cameras, indices = np.nonzero(inside & (low_margin >= 0) & (high_margin > 0));
+        return cameras, cells[cameras, indices];
+    
+    def get_cell_extents(self, cells):
+        rads = math.radians(self.orientation);
+        cos, sin = math.cos(rads), math.sin(rads);
+        about = (self.width / 2.0, self.height / 2.0);
+        left = float(self.width)/self.grid_width*(cells[:, 0]);
+        top = float(self.height)/self.grid_height*(cells[:, 1]);
+        xs = np.column_stack((left, left + CameraSimulation.CELL_SIZE)) - about[0];
+        ys = np.column_stack((top, top + CameraSimulation.CELL_SIZE)) - about[1];
+        us = xs[:, :, np.newaxis] * cos + ys[:, np.newaxis, :] * -sin + about[0];
+        vs = xs[:, :, np.newaxis] * sin + ys[:, np.newaxis, :] * cos + about[1];
+        us = us.reshape(-1, 4);
+        vs = vs.reshape(-1, 4);
+        return np.column_stack((us.min(axis=1), us.max(axis=1), vs.min(axis=1), vs.max(axis=1)));
+    
+    def get_view_margins(self, extents, center, vs):
+        # All four corners fall within [center - vs, center + vs) exactly when low >= 0 and high > 0
+        low = np.minimum(extents[:, 0] - (center[0] - vs), extents[:, 2] - (center[1] - vs));
+        high = np.minimum((center[0] + vs) - extents[:, 1], (center[1] + vs) - extents[:, 3]);
+        return low, high;
             
     def on_view(self, changed):
         if len(self.visible):
@@ -151,6 +253,32 @@ class CameraSimulation(PannableSimulation):
     def on_rotate(self, rotation):
         pass;
         
+    def get_profiled_hooks(self):
+        return PannableSimulation.get_profiled_hooks(self) + ['update_visible', 'on_view', 'on_move', 'on_rotate'];
+        
+    def get_trace_state(self):
+        state = PannableSimulation.get_trace_state(self);
+        state.update({'location': self.location,
+                      'orientation': self.orientation,
+                      'view_size': self.view_size,
+                      'keep_centered': self.keep_centered,
+                      'visible': np.array(sorted(self.visible), dtype=np.int32).reshape(-1, 2)});
+        return state;
+        
+    def set_trace_state(self, state):
+        PannableSimulation.set_trace_state(self, state);
+        self.location = tuple(state['location'].tolist());
+        self.orientation = state['orientation'].item();
+        self.view_size = state['view_size'].item();
+        self.keep_centered = state['keep_centered'].item();
+        self.visible = set(map(tuple, state['visible'].tolist()));
+        self.visible_cache = None;
+        
+    def get_trace_observation(self, particles):
+        observation = PannableSimulation.get_trace_observation(self, particles);
+        observation['visible'] = np.array(sorted(self.visible), dtype=np.int32).reshape(-1, 2);
+        return observation;
+        
     def get_instructions(self):
         instructions = PannableSimulation.get_instructions(self);
         return instructions + [['Move instrument - A/S/D/W',
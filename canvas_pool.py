@@ -0,0 +1,108 @@
+class CanvasItemPool:
+    
+    DEFAULT_LAYER = 'default';
+    
+    def __init__(self, canvas):
+        self.canvas = canvas;
+        self.layers = {};
+        self.keyed = {};
+        self.touched = {};
+        self.order = [];
+        self.cursors = {};
+        self.layer = None;
+        self.frame = 0;
+        self.restack = False;
+        self.reordered = set();
+        self.begin_frame();
+    
+    def begin_frame(self):
+        self.frame += 1;
+        self.order = [];
+        self.cursors = {};
+        self.touched = {};
+        self.restack = False;
+        self.reordered = set();
+        self.set_layer(CanvasItemPool.DEFAULT_LAYER);
+    
+    def set_layer(self, name):
+        self.layer = name;
+        if name not in self.cursors:
+            self.cursors[name] = 0;
+            self.order.append(name);
+    
+    def draw(self, kind, coords, options):
+        items = self.layers.setdefault(self.layer, []);
+        index = self.cursors[self.layer];
+        self.cursors[self.layer] = index + 1;
+        if index < len(items):
+            item = self.update(items[index], kind, coords, options);
+            if item is items[index]:
+                return item[0];
+            self.reordered.add(self.layer);
+            items[index] = item;
+        else:
+            item = self.update(None, kind, coords, options);
+            items.append(item);
+        return item[0];
+    
+    def draw_keyed(self, key, kind, coords, options):
+        items = self.keyed.setdefault(self.layer, {});
+        self.touched.setdefault(self.layer, set()).add(key);
+        item = self.update(items.get(key), kind, coords, options);
+        items[key] = item;
+        return item[0];
+    
+    def touch_keyed(self, keys):
+        items = self.keyed.get(self.layer, {});
+        self.touched.setdefault(self.layer, set()).update(keys);
+        return [key for key in keys if key not in items];
+    
+    def update(self, item, kind, coords, options):
+        coords = tuple(coords);
+        if item is not None:
+            item_id, item_kind, item_coords, item_options = item;
+            if item_kind == kind and set(item_options) == set(options):
+                if item_coords != coords:
+                    self.canvas.coords(item_id, *coords);
+                    item[2] = coords;
+                if item_options != options:
+                    self.canvas.itemconfig(item_id, **options);
+                    item[3] = options;
+                return item;
+            self.canvas.delete(item_id);
+        item_id = getattr(self.canvas, 'create_' + kind)(*coords, tags=(self.layer,), **options);
+        self.restack = True;
+        return [item_id, kind, coords, options];
+    
+    def keep_layer(self, name):
+        self.set_layer(name);
+        self.cursors[name] = len(self.layers.get(name, []));
+        self.touched[name] = set(self.keyed.get(name, {}));
+    
+    def move_layer(self, name, dx, dy):
+        self.canvas.move(name, dx, dy);
+        for item in self.layers.get(name, []) + self.keyed.get(name, {}).values():
+            item[2] = None;
+    
+    def end_frame(self):
+        for name, items in self.layers.items():
+            used = self.cursors.get(name, 0);
+            for item in items[used:]:
+                self.canvas.delete(item[0]);
+            del items[used:];
+        for name, items in self.keyed.items():
+            touched = self.touched.get(name, set());
+            for key in [key for key in items if key not in touched]:
+                self.canvas.delete(items.pop(key)[0]);
+        if self.restack:
+            for name in self.order:
+                if name in self.reordered:
+                    for item in self.layers[name]:
+                        self.canvas.tag_raise(item[0]);
+                    for item in self.keyed.get(name, {}).values():
+                        self.canvas.tag_raise(item[0]);
+                elif self.layers.get(name) or self.keyed.get(name):
+                    self.canvas.tag_raise(name);
+    
+    def get_item_count(self):
+        return sum(len(items) for items in self.layers.values()) + sum(len(items) for items in self.keyed.values());
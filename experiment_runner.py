@@ -0,0 +1,213 @@
+import os
+import csv
+import sys
+import math
+import time
+import shutil
+import argparse
+import tempfile
+import itertools
+import multiprocessing
+import numpy as np
+
+from camera_simulation import CameraSimulation
+from mcl_simulation import MCLSimulation
+from locationencodingmodel import *
+
+CONVERGENCE_DISTANCE = 2 * CameraSimulation.CELL_SIZE;
+
+def square_trajectory(steps, random):
+    side = 8;
+    moves = [['d'], ['s'], ['a'], ['w']];
+    return [moves[(i // side) % 4] for i in range(steps)];
+
+def turning_trajectory(steps, random):
+    moves = [['w'], ['w'], ['q', 'w'], ['w'], ['e', 'd'], ['d']];
+    return [moves[i % len(moves)] for i in range(steps)];
+
+def random_trajectory(steps, random):
+    moves = [['w'], ['a'], ['s'], ['d'], ['q'], ['e'], ['w', 'q'], ['d', 'e']];
+    return [moves[i] for i in random.randint(len(moves), size=steps)];
+
+TRAJECTORIES = {'square': square_trajectory,
+                'turning': turning_trajectory,
+                'random': random_trajectory};
+
+MODEL_TYPES = {'random': RandomModel,
+               'modulo': ModuloModel};
+
+# Models are loaded once per worker process; the memmapped files share their pages across processes
+loaded_models = {};
+
+def load_model(path):
+    if path not in loaded_models:
+        loaded_models[path] = LocationEncodingModel.load(path);
+    return loaded_models[path];
+
+def build_models(trials, directory):
+    paths = {};
+    for trial in trials:
+        key = trial['model_key'];
+        if key not in paths:
+            model_type, n, m, k, seed = key;
+            model = MODEL_TYPES[model_type](n, m, k=k, seed=seed) if model_type == 'random' else MODEL_TYPES[model_type](n, m, k=k);
+            paths[key] = os.path.join(directory, '%s_%dx%d_k%d_s%d.lem' % (model_type, n, m, k, seed));
+            model.save(paths[key]);
+        trial['model_path'] = paths[key];
+    return paths;
+
+def run_trial(trial):
+    seed = trial['seed'];
+    np.random.seed(seed);
+    random = np.random.RandomState(seed);
+    model = load_model(trial['model_path']);
+    cells = CameraSimulation.CELL_SIZE;
+    sim = MCLSimulation(model.n * cells, model.m * cells, headless=True, location_encoding_model=model,
+                        particle_count=trial['particles'], adaptive_particles=trial['adaptive'], mcl_seed=seed);
+    margin = sim.view_size;
+    sim.location = tuple(margin + random.rand(2) * (sim.width - 2 * margin, sim.height - 2 * margin));
+    sim.update_visible();
+    
+    rows = [];
+    start = time.time();
+    for step, keysyms in enumerate(TRAJECTORIES[trial['trajectory']](trial['steps'], random)):
+        sim.step(keysyms);
+        position, orientation_offset = sim.mcl.get_estimate();
+        rows.append({'step': step,
+                     'translation_error': math.hypot(position[0] - sim.location[0], position[1] - sim.location[1]),
+                     'rotation_error': abs((orientation_offset + 180) % 360 - 180),
+                     'variance': sim.mcl.get_variance(),
+                     'particles': sim.mcl.get_count()});
+    elapsed = time.time() - start;
+    
+    errors = np.array([row['translation_error'] for row in rows]);
+    # Converged at the first step after which the estimate never leaves CONVERGENCE_DISTANCE again
+    outside = np.nonzero(errors > CONVERGENCE_DISTANCE)[0];
+    converged_at = 0 if not len(outside) else outside[-1] + 1;
+    result = dict((key, trial[key]) for key in ['model', 'k', 'grid', 'particles', 'trajectory', 'seed', 'adaptive']);
+    result.update({'steps': rows,
+                   'final_error': errors[-1],
+                   'mean_error': errors.mean(),
+                   'final_rotation_error': rows[-1]['rotation_error'],
+                   'final_variance': rows[-1]['variance'],
+                   'convergence_step': converged_at if converged_at < len(rows) else None,
+                   'steps_per_second': len(rows) / elapsed if elapsed > 0 else float('inf'),
+                   'worker': os.getpid()});
+    return result;
+
+def check_repeatable(trial):
+    # Trials are only comparable if a seed fixes everything, so one trial is run twice and must match step for step
+    first, second = run_trial(dict(trial)), run_trial(dict(trial));
+    keys = ['translation_error', 'rotation_error', 'variance', 'particles'];
+    for a, b in zip(first['steps'], second['steps']):
+        if [a[key] for key in keys] != [b[key] for key in keys]:
+            raise RuntimeError('Trial with seed ' + str(trial['seed']) + ' differs between runs at step ' + str(a['step']));
+
+def make_trials(args):
+    trials = [];
+    for model, k, grid, particles, trajectory, seed in itertools.product(args.models, args.k, args.grid, args.particles,
+                                                                          args.trajectories, range(args.seeds)):
+        n, m = grid;
+        trials.append({'model': model, 'k': k, 'grid': '%dx%d' % grid, 'particles': particles, 'trajectory': trajectory,
+                       'seed': args.first_seed + seed, 'steps': args.steps, 'adaptive': args.adaptive,
+                       'model_key': (model, n, m, k, args.model_seed)});
+    return trials;
+
+def summarize(results):
+    groups = {};
+    for result in results:
+        key = tuple(result[name] for name in ['model', 'k', 'grid', 'particles', 'trajectory']);
+        groups.setdefault(key, []).append(result);
+    summary = [];
+    for key in sorted(groups):
+        group = groups[key];
+        converged = [result['convergence_step'] for result in group if result['convergence_step'] is not None];
+        summary.append(dict(zip(['model', 'k', 'grid', 'particles', 'trajectory'], key) + [
+            ('trials', len(group)),
+            ('final_error', np.mean([result['final_error'] for result in group])),
+            ('median_final_error', np.median([result['final_error'] for result in group])),
+            ('mean_error', np.mean([result['mean_error'] for result in group])),
+            ('rotation_error', np.mean([result['final_rotation_error'] for result in group])),
+            ('variance', np.mean([result['final_variance'] for result in group])),
+            ('converged', 100.0 * len(converged) / len(group)),
+            ('convergence_step', np.mean(converged) if converged else float('nan')),
+            ('steps_per_second', np.mean([result['steps_per_second'] for result in group]))]));
+    return summary;
+
+SUMMARY_COLUMNS = [('model', '%s'), ('k', '%d'), ('grid', '%s'), ('particles', '%d'), ('trajectory', '%s'), ('trials', '%d'),
+                   ('final_error', '%.1f'), ('median_final_error', '%.1f'), ('mean_error', '%.1f'), ('rotation_error', '%.1f'),
+                   ('variance', '%.0f'), ('converged', '%.0f%%'), ('convergence_step', '%.1f'), ('steps_per_second', '%.1f')];
+
+def print_summary(summary):
+    table = [[name for name, _ in SUMMARY_COLUMNS]] + [[form % row[name] for name, form in SUMMARY_COLUMNS] for row in summary];
+    widths = [max(len(line[i]) for line in table) for i in range(len(SUMMARY_COLUMNS))];
+    for line in table:
+        print '  '.join(cell.rjust(width) for cell, width in zip(line, widths));
+
+def write_csv(path, rows, columns):
+    with open(path, 'wb') as f:
+        writer = csv.DictWriter(f, columns, extrasaction='ignore');
+        writer.writeheader();
+        writer.writerows(rows);
+
+def parse_grid(value):
+    n, _, m = value.partition('x');
+    return int(n), int(m or n);
+
+def main():
+    parser = argparse.ArgumentParser(description='Run headless MCL localization trials in parallel and summarize them');
+    parser.add_argument('--models', nargs='+', default=['random', 'modulo'], choices=sorted(MODEL_TYPES));
+    parser.add_argument('--k', nargs='+', type=int, default=[64, 128]);
+    parser.add_argument('--grid', nargs='+', type=parse_grid, default=[(25, 20)], help='grid sizes in cells, e.g. 25x20');
+    parser.add_argument('--particles', nargs='+', type=int, default=[1000]);
+    parser.add_argument('--trajectories', nargs='+', default=['square'], choices=sorted(TRAJECTORIES));
+    parser.add_argument('--seeds', type=int, default=10, help='trials per configuration');
+    parser.add_argument('--first-seed', type=int, default=0);
+    parser.add_argument('--model-seed', type=int, default=0, help='seed of the shared RandomModel instances');
+    parser.add_argument('--steps', type=int, default=60);
+    parser.add_argument('--adaptive', action='store_true', help='use KLD-adaptive particle counts');
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count());
+    parser.add_argument('--steps-csv', help='write every per-step record to this file');
+    parser.add_argument('--summary-csv', help='write the summary table to this file');
+    parser.add_argument('--no-repeat-check', action='store_true', help='skip running the first trial twice to check it repeats');
+    args = parser.parse_args();
+    
+    trials = make_trials(args);
+    directory = tempfile.mkdtemp(prefix='experiments');
+    try:
+        start = time.time();
+        paths = build_models(trials, directory);
+        print ('Built ' + str(len(paths)) + ' models in ' + str(round(time.time() - start, 1)) + 's, running '
+               + str(len(trials)) + ' trials on ' + str(args.processes) + ' processes');
+        if not args.no_repeat_check:
+            check_repeatable(trials[0]);
+        start = time.time();
+        if args.processes > 1:
+            pool = multiprocessing.Pool(args.processes);
+            results = [];
+            for result in pool.imap_unordered(run_trial, trials):
+                results.append(result);
+                sys.stdout.write('\r' + str(len(results)) + ' / ' + str(len(trials)));
+                sys.stdout.flush();
+            pool.close();
+            pool.join();
+            print;
+        else:
+            results = map(run_trial, trials);
+        elapsed = time.time() - start;
+    finally:
+        shutil.rmtree(directory);
+    
+    summary = summarize(results);
+    print_summary(summary);
+    print str(len(trials)) + ' trials in ' + str(round(elapsed, 1)) + 's (' + str(round(len(trials) / elapsed, 2)) + ' trials/s)';
+    if args.steps_csv:
+        rows = [dict(step, **dict((key, result[key]) for key in ['model', 'k', 'grid', 'trajectory', 'seed']))
+                for result in results for step in result['steps']];
+        write_csv(args.steps_csv, rows, ['model', 'k', 'grid', 'trajectory', 'seed', 'step', 'particles',
+                                         'translation_error', 'rotation_error', 'variance']);
+    if args.summary_csv:
+        write_csv(args.summary_csv, summary, [name for name, _ in SUMMARY_COLUMNS]);
+
+if __name__ == '__main__':
+    main();
@@ -1,33 +1,185 @@
-import random
+import struct
+import numpy as np
 
-class LocationEncodingModel:
+from .patch_index import PatchIndex
+from .match_cache import MatchCache
+
+class LocationEncodingModel(object):
+    
+    FILE_MAGIC = 'LEMODEL1';
+    FILE_HEADER = struct.Struct('<8s32s8q');
+    FILE_ALIGNMENT = 4096;
     
     def __init__(self, n, m):
         self.n = n;
         self.m = m;
-        self.cell_data_map = {};
-        self.data_cell_map = {};
-        for i in range(n):
-            for j in range(m):
-                data = self.generate(i, j);
-                self.cell_data_map[(i, j)] = data;
-                self.data_cell_map[data] = self.data_cell_map.get(data, []) + [(i, j)];
-        
+        self.codes = np.ascontiguousarray(self.generate_all(), dtype=np.int32);
+        self.build_index();
+        self.patch_index = None;
+    
+    def generate_all(self):
+        return [[self.generate(i, j) for j in range(self.m)] for i in range(self.n)];
+    
+    def build_index(self):
+        flat = self.codes.ravel();
+        cell_type = np.int32 if flat.size < 2 ** 31 else np.int64;
+        keys = flat.astype(np.int64) * flat.size + np.arange(flat.size);
+        keys.sort();
+        self.index_cells = (keys % flat.size).astype(cell_type);
+        counts = np.bincount(flat, minlength=getattr(self, 'k', 0));
+        self.index_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64);
+    
     def observe(self, cell):
-        return self.cell_data_map.get(cell, None);
+        i, j = cell;
+        if 0 <= i < self.n and 0 <= j < self.m:
+            return int(self.codes[i, j]);
+        return None;
     
     def lookup(self, data):
-        return self.data_cell_map.get(data, []);
+        return map(tuple, self.lookup_array(data).tolist());
+    
+    def lookup_array(self, data):
+        if data is None or not 0 <= data < len(self.index_offsets) - 1:
+            return np.empty((0, 2), dtype=np.int64);
+        cells = self.index_cells[self.index_offsets[data]:self.index_offsets[data + 1]];
+        return np.column_stack((cells // self.m, cells % self.m)).astype(np.int64);
+    
+    def get_codes(self):
+        return self.codes;
+    
+    def observe_array(self, i, j):
+        i = np.asarray(i);
+        j = np.asarray(j);
+        inside = (i >= 0) & (i < self.n) & (j >= 0) & (j < self.m);
+        codes = np.full(np.shape(i), -1, dtype=np.int64);
+        codes[inside] = self.codes[i[inside], j[inside]];
+        return codes;
+    
+    def save(self, path):
+        codes = np.ascontiguousarray(self.codes, dtype=np.int32);
+        index_offsets = np.ascontiguousarray(self.index_offsets, dtype=np.int64);
+        index_cells = np.ascontiguousarray(self.index_cells);
+        align = lambda offset: -(-offset // LocationEncodingModel.FILE_ALIGNMENT) * LocationEncodingModel.FILE_ALIGNMENT;
+        codes_offset = align(LocationEncodingModel.FILE_HEADER.size);
+        index_offsets_offset = align(codes_offset + codes.nbytes);
+        index_cells_offset = align(index_offsets_offset + index_offsets.nbytes);
+        seed = getattr(self, 'seed', None);
+        header = LocationEncodingModel.FILE_HEADER.pack(LocationEncodingModel.FILE_MAGIC, type(self).__name__,
+                                                        self.n, self.m, getattr(self, 'k', len(index_offsets) - 1),
+                                                        -1 if seed is None else seed, index_cells.itemsize,
+                                                        codes_offset, index_offsets_offset, index_cells_offset);
+        with open(path, 'wb') as f:
+            f.write(header);
+            for offset, array in [(codes_offset, codes), (index_offsets_offset, index_offsets), (index_cells_offset, index_cells)]:
+                f.seek(offset);
+                array.tofile(f);
+    
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            header = f.read(LocationEncodingModel.FILE_HEADER.size);
+        (magic, name, n, m, k, seed, cell_size,
+         codes_offset, index_offsets_offset, index_cells_offset) = LocationEncodingModel.FILE_HEADER.unpack(header);
+        if magic != LocationEncodingModel.FILE_MAGIC:
+            raise ValueError(path + ' is not a location encoding model file');
+        # Subclasses defined elsewhere aren't known here; their codes still load into a plain model
+        model_type = globals().get(name.rstrip('\0'));
+        if not (isinstance(model_type, type) and issubclass(model_type, LocationEncodingModel)):
+            model_type = LocationEncodingModel;
+        model = model_type.__new__(model_type);
+        model.n = n;
+        model.m = m;
+        model.k = k;
+        model.seed = None if seed < 0 else seed;
+        model.random = np.random.RandomState(model.seed);
+        model.codes = np.memmap(path, dtype=np.int32, mode='r', offset=codes_offset, shape=(n, m));
+        model.index_offsets = np.memmap(path, dtype=np.int64, mode='r', offset=index_offsets_offset, shape=(k + 1,));
+        model.index_cells = np.memmap(path, dtype=np.int32 if cell_size == 4 else np.int64, mode='r',
+                                      offset=index_cells_offset, shape=(n * m,));
+        model.patch_index = None;
+        return model;
     
+    def enable_patch_index(self, memory_budget=256 << 20, build_after=2):
+        self.patch_index = PatchIndex(self, memory_budget, build_after);
+    
+    def disable_patch_index(self):
+        self.patch_index = None;
+    
+    def get_match_context(self):
+        # Whatever besides the observation decides match results, for MatchCache keys; None if results can't be cached
+        return ();
+    
+    def match(self, data, offsets, observed, chunk_size=1 << 20):
+        if self.patch_index is not None and len(offsets):
+            matches = self.patch_index.lookup(np.vstack(([(0, 0)], offsets)), np.concatenate(([data], observed)));
+            if matches is not None:
+                return matches;
+        candidates = self.lookup_array(data);
+        offsets = np.asarray(offsets, dtype=np.int64).reshape(-1, 2);
+        observed = np.asarray(observed, dtype=np.int64).reshape(-1, 1);
+        if not len(offsets) or not len(candidates):
+            return candidates;
+        step = max(1, chunk_size // len(offsets));
+        matches = [];
+        for start in range(0, len(candidates), step):
+            chunk = candidates[start:start + step];
+            codes = self.observe_array(chunk[:, 0] + offsets[:, 0:1], chunk[:, 1] + offsets[:, 1:2]);
+            matches.append(chunk[(codes == observed).all(axis=0)]);
+        return np.concatenate(matches);
+    
+    def match_batch(self, data, offsets, observed, chunk_size=1 << 20):
+        # Matches several observations (one per agent) with a single observe_array call per chunk of agents
+        # instead of one match call each; results are in the same order as the inputs
+        if self.patch_index is not None:
+            return [self.match(*args) for args in zip(data, offsets, observed)];
+        candidates = [self.lookup_array(d) for d in data];
+        offsets = [np.asarray(o, dtype=np.int64).reshape(-1, 2) for o in offsets];
+        observed = [np.asarray(o, dtype=np.int64).ravel() for o in observed];
+        matches = list(candidates);
+        batch = [];
+        size = 0;
+        for agent in range(len(candidates)):
+            pairs = len(candidates[agent]) * len(offsets[agent]);
+            if not pairs:
+                continue;
+            if pairs > chunk_size:
+                matches[agent] = self.match(data[agent], offsets[agent], observed[agent], chunk_size);
+                continue;
+            if size + pairs > chunk_size:
+                self.match_chunk(batch, candidates, offsets, observed, matches);
+                batch = [];
+                size = 0;
+            batch.append(agent);
+            size += pairs;
+        if batch:
+            self.match_chunk(batch, candidates, offsets, observed, matches);
+        return matches;
+    
+    def match_chunk(self, agents, candidates, offsets, observed, matches):
+        cells = np.concatenate([np.repeat(candidates[a], len(offsets[a]), axis=0) for a in agents]);
+        cell_offsets = np.concatenate([np.tile(offsets[a], (len(candidates[a]), 1)) for a in agents]);
+        expected = np.concatenate([np.tile(observed[a], len(candidates[a])) for a in agents]);
+        equal = self.observe_array(cells[:, 0] + cell_offsets[:, 0], cells[:, 1] + cell_offsets[:, 1]) == expected;
+        start = 0;
+        for a in agents:
+            end = start + len(candidates[a]) * len(offsets[a]);
+            matches[a] = candidates[a][equal[start:end].reshape(len(candidates[a]), -1).all(axis=1)];
+            start = end;
+
 class RandomModel(LocationEncodingModel):
     
-    def __init__(self, n, m, k=128):
+    def __init__(self, n, m, k=128, seed=None):
         self.k = k;
+        self.seed = seed;
+        self.random = np.random.RandomState(seed);
         LocationEncodingModel.__init__(self, n, m);
     
     def generate(self, i, j):
-        return random.randrange(self.k);
+        return self.random.randint(self.k);
     
+    def generate_all(self):
+        return self.random.randint(self.k, size=(self.n, self.m), dtype=np.int32);
+
 class ModuloModel(LocationEncodingModel):
     
     def __init__(self, n, m, k=64):
@@ -36,3 +188,10 @@ class ModuloModel(LocationEncodingModel):
     
     def generate(self, i, j):
         return (j * self.n + i) % self.k;
+    
+    def generate_all(self):
+        i = np.arange(self.n, dtype=np.int64)[:, np.newaxis];
+        j = np.arange(self.m, dtype=np.int64)[np.newaxis, :];
+        return (j * self.n + i) % self.k;
+
+from .tiled import TiledModel
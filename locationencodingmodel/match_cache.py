@@ -0,0 +1,111 @@
+import numpy as np
+from collections import OrderedDict
+
+class MatchCache:
+
+    # Remembers the matches of recent observations, keyed by the observed footprint and codes relative to its
+    # lowest cell, so the same pattern seen from another master cell (or by another agent) is also a hit.
+    # Entries are the matched anchors, the lowest cells, and hold a reference to the model they came from;
+    # any other model clears the cache.
+    def __init__(self, memory_budget=32 << 20):
+        self.memory_budget = memory_budget;
+        self.model = None;
+        self.entries = OrderedDict();
+        self.bytes = 0;
+        self.hits = 0;
+        self.misses = 0;
+        self.bypassed = 0;
+        self.invalidations = 0;
+
+    def normalize(self, context, data, offsets, observed):
+        offsets = np.vstack(([(0, 0)], np.asarray(offsets, dtype=np.int64).reshape(-1, 2)));
+        codes = np.concatenate(([data], np.asarray(observed, dtype=np.int64).ravel())).astype(np.int64);
+        order = np.lexsort((offsets[:, 1], offsets[:, 0]));
+        anchor = offsets[order[0]];
+        return (context, (offsets[order] - anchor).tobytes(), codes[order].tobytes()), anchor;
+
+    def use_model(self, model):
+        if model is not self.model:
+            if self.model is not None:
+                self.invalidations += 1;
+            self.clear();
+            self.model = model;
+
+    def get(self, key, anchor):
+        entry = self.entries.pop(key, None);
+        if entry is None:
+            self.misses += 1;
+            return None;
+        self.entries[key] = entry;
+        self.hits += 1;
+        return entry - anchor;
+
+    def put(self, key, anchor, matches):
+        entry = matches + anchor;
+        if entry.nbytes > self.memory_budget:
+            return;
+        previous = self.entries.pop(key, None);
+        if previous is not None:
+            self.bytes -= previous.nbytes;
+        self.entries[key] = entry;
+        self.bytes += entry.nbytes;
+        while self.bytes > self.memory_budget:
+            _, evicted = self.entries.popitem(last=False);
+            self.bytes -= evicted.nbytes;
+
+    def match(self, model, data, offsets, observed):
+        self.use_model(model);
+        context = model.get_match_context();
+        if context is None:
+            self.bypassed += 1;
+            return model.match(data, offsets, observed);
+        key, anchor = self.normalize(context, data, offsets, observed);
+        matches = self.get(key, anchor);
+        if matches is None:
+            matches = model.match(data, offsets, observed);
+            self.put(key, anchor, matches);
+        return matches;
+
+    def match_batch(self, model, data, offsets, observed):
+        # Hits are answered here and only the misses go to the model's batched match
+        self.use_model(model);
+        context = model.get_match_context();
+        if context is None:
+            self.bypassed += len(data);
+            return model.match_batch(data, offsets, observed);
+        keys = [self.normalize(context, *args) for args in zip(data, offsets, observed)];
+        matches = [None] * len(keys);
+        # Agents missing on the same pattern share one query: the first of them asks the model and the rest
+        # shift its anchors by their own
+        missing = OrderedDict();
+        for index, (key, anchor) in enumerate(keys):
+            if key in missing:
+                self.misses += 1;
+                missing[key].append(index);
+                continue;
+            matches[index] = self.get(key, anchor);
+            if matches[index] is None:
+                missing[key] = [index];
+        if missing:
+            first = [indices[0] for indices in missing.values()];
+            found = model.match_batch([data[index] for index in first], [offsets[index] for index in first],
+                                      [observed[index] for index in first]);
+            for indices, result in zip(missing.values(), found):
+                key, anchor = keys[indices[0]];
+                self.put(key, anchor, result);
+                anchored = result + anchor;
+                for index in indices:
+                    matches[index] = anchored - keys[index][1];
+        return matches;
+
+    def clear(self):
+        self.entries = OrderedDict();
+        self.bytes = 0;
+
+    def get_stats(self):
+        return {'entries': len(self.entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'bypassed': self.bypassed,
+                'invalidations': self.invalidations};
@@ -0,0 +1,96 @@
+import time
+import numpy as np
+from collections import OrderedDict
+
+class PatchIndex:
+
+    HASH_BASE = np.uint64(1000003);
+    BYTES_PER_ENTRY = 16;
+
+    def __init__(self, model, memory_budget=256 << 20, build_after=2):
+        self.model = model;
+        self.memory_budget = memory_budget;
+        self.build_after = build_after;
+        self.shapes = OrderedDict();
+        self.requests = {};
+        self.hits = 0;
+        self.misses = 0;
+
+    def normalize(self, offsets, observed):
+        offsets = np.asarray(offsets, dtype=np.int64).reshape(-1, 2);
+        order = np.lexsort((offsets[:, 1], offsets[:, 0]));
+        anchor = offsets[order[0]];
+        shape = tuple(map(tuple, (offsets[order] - anchor).tolist()));
+        return shape, anchor, np.asarray(observed, dtype=np.int64)[order];
+
+    def hash_codes(self, codes):
+        h = np.uint64(0);
+        for code in codes:
+            h = h * PatchIndex.HASH_BASE + (np.asarray(code) + 1).astype(np.uint64);
+        return h;
+
+    def window(self, shape):
+        offsets = np.array(shape);
+        low_j = -min(0, offsets[:, 1].min());
+        high_i = self.model.n - offsets[:, 0].max();
+        high_j = self.model.m - max(0, offsets[:, 1].max());
+        return low_j, max(0, high_i), max(low_j, high_j);
+
+    def build(self, shape):
+        start = time.time();
+        low_j, high_i, high_j = self.window(shape);
+        size = high_i * (high_j - low_j);
+        if size * PatchIndex.BYTES_PER_ENTRY > self.memory_budget:
+            return None;
+        while self.shapes and self.get_size() + size * PatchIndex.BYTES_PER_ENTRY > self.memory_budget:
+            self.shapes.popitem(last=False);
+        codes = self.model.get_codes();
+        patches = (codes[di:di + high_i, low_j + dj:high_j + dj] for di, dj in shape);
+        hashes = self.hash_codes(patches).ravel();
+        order = np.argsort(hashes, kind='mergesort');
+        entry = {'hashes': hashes[order],
+                 'origins': order,
+                 'width': high_j - low_j,
+                 'low_j': low_j,
+                 'bytes': size * PatchIndex.BYTES_PER_ENTRY,
+                 'build_time': time.time() - start};
+        self.shapes[shape] = entry;
+        return entry;
+
+    def get_entry(self, shape):
+        if shape in self.shapes:
+            self.shapes[shape] = self.shapes.pop(shape);
+            return self.shapes[shape];
+        self.requests[shape] = self.requests.get(shape, 0) + 1;
+        if self.requests[shape] < self.build_after:
+            return None;
+        del self.requests[shape];
+        return self.build(shape);
+
+    def lookup(self, offsets, observed):
+        shape, anchor, observed = self.normalize(offsets, observed);
+        entry = self.get_entry(shape);
+        if entry is None:
+            self.misses += 1;
+            return None;
+        self.hits += 1;
+        h = self.hash_codes(observed[:, np.newaxis])[0];
+        low = np.searchsorted(entry['hashes'], h, side='left');
+        high = np.searchsorted(entry['hashes'], h, side='right');
+        origins = entry['origins'][low:high];
+        anchors = np.column_stack((origins // entry['width'], origins % entry['width'] + entry['low_j']));
+        shape = np.array(shape);
+        codes = self.model.observe_array(anchors[:, 0] + shape[:, 0:1], anchors[:, 1] + shape[:, 1:2]);
+        anchors = anchors[(codes == observed[:, np.newaxis]).all(axis=0)];
+        references = anchors - anchor;
+        return references[np.lexsort((references[:, 1], references[:, 0]))];
+
+    def get_size(self):
+        return sum(entry['bytes'] for entry in self.shapes.values());
+
+    def get_stats(self):
+        return {'shapes': len(self.shapes),
+                'bytes': self.get_size(),
+                'build_time': sum(entry['build_time'] for entry in self.shapes.values()),
+                'hits': self.hits,
+                'misses': self.misses};
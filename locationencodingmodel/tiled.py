@@ -0,0 +1,161 @@
+import numpy as np
+from collections import OrderedDict
+
+from . import LocationEncodingModel
+
+class TiledModel(LocationEncodingModel):
+
+    # Codes and inverted index per cell once a tile has been searched
+    BYTES_PER_CELL = 8;
+
+    # Random codes generated lazily in square tiles. Tile (ti, tj) always draws from RandomState([seed, ti, tj]),
+    # so evicted tiles come back identical, and only the tiles in the LRU cache take memory. Each tile carries
+    # its own inverted index, built the first time the tile is searched. Lookups search the region given to
+    # set_search_region, or the whole world when that fits in the budget; what happens to be cached never
+    # changes a result.
+    def __init__(self, n, m, k=128, seed=None, tile_size=256, memory_budget=64 << 20):
+        self.n = n;
+        self.m = m;
+        self.k = k;
+        self.seed = np.random.RandomState().randint(1 << 31) if seed is None else seed;
+        self.random = np.random.RandomState(self.seed);
+        self.tile_size = tile_size;
+        self.memory_budget = memory_budget;
+        self.tile_rows = -(-n // tile_size);
+        self.tile_columns = -(-m // tile_size);
+        self.tiles = OrderedDict();
+        self.tile_bytes = 0;
+        self.search_tiles = None;
+        self.generated = 0;
+        self.indexed = 0;
+        self.evicted = 0;
+        self.patch_index = None;
+
+    def get_tile(self, tile):
+        entry = self.tiles.pop(tile, None);
+        if entry is None:
+            ti, tj = tile;
+            rows = min(self.tile_size, self.n - ti * self.tile_size);
+            columns = min(self.tile_size, self.m - tj * self.tile_size);
+            codes = np.random.RandomState([self.seed, ti, tj]).randint(self.k, size=(rows, columns), dtype=np.int32);
+            entry = {'codes': codes, 'index_cells': None, 'index_offsets': None, 'bytes': codes.nbytes};
+            self.generated += 1;
+            self.tile_bytes += entry['bytes'];
+        self.tiles[tile] = entry;
+        self.evict();
+        return entry;
+
+    def get_tile_index(self, tile):
+        entry = self.get_tile(tile);
+        if entry['index_cells'] is None:
+            flat = entry['codes'].ravel();
+            keys = flat.astype(np.int64) * flat.size + np.arange(flat.size);
+            keys.sort();
+            entry['index_cells'] = (keys % flat.size).astype(np.int32);
+            entry['index_offsets'] = np.concatenate(([0], np.cumsum(np.bincount(flat, minlength=self.k)))).astype(np.int64);
+            added = entry['index_cells'].nbytes + entry['index_offsets'].nbytes;
+            entry['bytes'] += added;
+            self.tile_bytes += added;
+            self.indexed += 1;
+            self.evict();
+        return entry;
+
+    def evict(self):
+        # The most recently used tile always stays, even when it alone exceeds the budget
+        while len(self.tiles) > 1 and self.tile_bytes > self.memory_budget:
+            _, entry = self.tiles.popitem(last=False);
+            self.tile_bytes -= entry['bytes'];
+            self.evicted += 1;
+
+    def observe(self, cell):
+        i, j = cell;
+        if 0 <= i < self.n and 0 <= j < self.m:
+            return int(self.get_tile((i // self.tile_size, j // self.tile_size))['codes'][i % self.tile_size, j % self.tile_size]);
+        return None;
+
+    def observe_array(self, i, j):
+        i = np.asarray(i);
+        j = np.asarray(j);
+        inside = (i >= 0) & (i < self.n) & (j >= 0) & (j < self.m);
+        codes = np.full(np.shape(i), -1, dtype=np.int64);
+        i, j = i[inside], j[inside];
+        keys = (i // self.tile_size) * self.tile_columns + j // self.tile_size;
+        tiles, inverse = np.unique(keys, return_inverse=True);
+        values = np.empty(len(keys), dtype=np.int64);
+        for index, key in enumerate(tiles.tolist()):
+            selected = inverse == index;
+            tile_codes = self.get_tile(divmod(key, self.tile_columns))['codes'];
+            values[selected] = tile_codes[i[selected] % self.tile_size, j[selected] % self.tile_size];
+        codes[inside] = values;
+        return codes;
+
+    def get_tile_limit(self):
+        # How many searched tiles fit in the budget at once
+        return self.memory_budget // (self.tile_size ** 2 * TiledModel.BYTES_PER_CELL + (self.k + 1) * 8);
+
+    def get_region_limit(self):
+        # The most cells a square search region can cover without its tiles evicting each other; an unaligned
+        # region of s tiles' width touches s + 1 tiles per side
+        side = max(1, int(np.sqrt(self.get_tile_limit())) - 1);
+        return (side * self.tile_size) ** 2;
+
+    def set_search_region(self, low, high):
+        # Limits lookups to the tiles overlapping the cells from low to high inclusive; None searches the whole world
+        if low is None:
+            self.search_tiles = None;
+            return;
+        low_ti, low_tj = max(0, low[0] // self.tile_size), max(0, low[1] // self.tile_size);
+        high_ti = min(self.tile_rows - 1, high[0] // self.tile_size);
+        high_tj = min(self.tile_columns - 1, high[1] // self.tile_size);
+        self.search_tiles = [(ti, tj) for ti in range(low_ti, high_ti + 1) for tj in range(low_tj, high_tj + 1)];
+
+    def get_search_tiles(self):
+        if self.search_tiles is not None:
+            return self.search_tiles;
+        if self.tile_rows * self.tile_columns > self.get_tile_limit():
+            raise ValueError('A ' + str(self.n) + ' x ' + str(self.m) + ' tiled model is larger than its memory budget; '
+                             + 'lookups need a region from set_search_region');
+        return [(ti, tj) for ti in range(self.tile_rows) for tj in range(self.tile_columns)];
+
+    def lookup_array(self, data):
+        if data is None or not 0 <= data < self.k:
+            return np.empty((0, 2), dtype=np.int64);
+        cells = [];
+        for ti, tj in self.get_search_tiles():
+            entry = self.get_tile_index((ti, tj));
+            local = entry['index_cells'][entry['index_offsets'][data]:entry['index_offsets'][data + 1]];
+            columns = entry['codes'].shape[1];
+            cells.append(np.column_stack((local // columns + ti * self.tile_size, local % columns + tj * self.tile_size)));
+        if not cells:
+            return np.empty((0, 2), dtype=np.int64);
+        cells = np.concatenate(cells).astype(np.int64);
+        return cells[np.lexsort((cells[:, 1], cells[:, 0]))];
+
+    def get_match_context(self):
+        # Regions are rectangles of tiles, so the first and last tile name one
+        return () if self.search_tiles is None else tuple(self.search_tiles[:1] + self.search_tiles[-1:]);
+
+    def get_codes(self):
+        raise ValueError('A tiled model has no full code array; use observe_array');
+
+    def save(self, path):
+        raise ValueError('A tiled model is defined by its parameters and is not saved as a code array');
+
+    def enable_patch_index(self, memory_budget=256 << 20, build_after=2):
+        raise ValueError('Patch indexes need the full code array, which a tiled model never builds');
+
+    def get_state(self):
+        return {'search_tiles': None if self.search_tiles is None else np.array(self.search_tiles, dtype=np.int64).reshape(-1, 2)};
+
+    def set_state(self, state):
+        self.search_tiles = None if state['search_tiles'] is None else map(tuple, state['search_tiles'].tolist());
+
+    def get_options(self):
+        return {'k': self.k, 'seed': self.seed, 'tile_size': self.tile_size, 'memory_budget': self.memory_budget};
+
+    def get_stats(self):
+        return {'resident': len(self.tiles),
+                'bytes': self.tile_bytes,
+                'generated': self.generated,
+                'indexed': self.indexed,
+                'evicted': self.evicted};
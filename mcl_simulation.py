@@ -1,25 +1,70 @@
 import math
+import time
+import warnings
 import numpy as np
 from sklearn import mixture
+from sklearn.exceptions import ConvergenceWarning
 
 from simulation import Simulation
 from observation_simulation import ObservationSimulation
 from locationencodingmodel import *
-from mcl import MCL
+from arraymcl import ArrayMCL, KLDSampling
+from mcl_worker import MCLWorker, MCLSnapshot
+from spatial_index import GridIndex
 
 class MCLSimulation(ObservationSimulation):
     
-    def __init__(self, width, height, rotation=0, location_encoding_model_type=RandomModel, title='MCLSimulation', **kwargs):
-        ObservationSimulation.__init__(self, width, height, rotation, location_encoding_model_type=location_encoding_model_type, title=title);
-        self.mcl = MCL(1000, (self.width, self.height));
+    MIXTURE_COMPONENTS = 4;
+    DENSITY_COLOR = (255, 0, 0);
+    
+    def __init__(self, width, height, rotation=0, location_encoding_model_type=RandomModel, title='MCLSimulation', headless=False, retained=True,
+                 incremental_mixture=True, mixture_sample_size=500, mixture_budget=20, mixture_backoff=10, threaded_mcl=False,
+                 particle_glyph_threshold=2000, density_cell_size=3, particle_count=1000, adaptive_particles=True,
+                 min_particles=200, max_particles=20000, recovery_rates=(0.05, 0.5), resample_policy='ess', resample_threshold=0.2,
+                 resample_interval=1, likelihood_mode='auto', mcl_seed=None, **kwargs):
+        ObservationSimulation.__init__(self, width, height, rotation, location_encoding_model_type=location_encoding_model_type, title=title, headless=headless, retained=retained, **kwargs);
+        sampler = KLDSampling(min_particles, max_particles) if adaptive_particles else None;
+        self.mcl = ArrayMCL(particle_count, (self.width, self.height), sampler=sampler, recovery_rates=recovery_rates,
+                            resample_policy=resample_policy, resample_threshold=resample_threshold, resample_interval=resample_interval,
+                            likelihood_mode=likelihood_mode, seed=mcl_seed);
         self.auto_mcl = True;
         self.update_on_view_change_only = True;
         self.view_particles = True;
+        self.density_particles = True;
+        self.particle_glyph_threshold = particle_glyph_threshold;
+        self.density_cell_size = density_cell_size;
+        self.particle_view_mode = '--';
+        self.particle_index = GridIndex(ObservationSimulation.INDEX_BUCKET_SIZE);
+        self.particle_index_key = None;
         self.mixture = [];
+        self.mixture_mean_weight = 0;
+        self.incremental_mixture = incremental_mixture;
+        self.mixture_sample_size = mixture_sample_size;
+        self.mixture_budget = mixture_budget;
+        self.mixture_backoff = mixture_backoff;
+        self.mixture_model = None;
+        self.mixture_version = None;
+        self.mixture_fit_time = 0.0;
+        self.mixture_method = '--';
+        self.mixture_skips = 0;
+        self.mixture_stale = False;
+        self.mixture_random = np.random.RandomState();
+        self.mcl_worker = None;
+        # seed (passed on to the model type) only fixes the world; mcl_seed also fixes the initial particles and
+        # every later draw, which is what repeatable trials need
+        if mcl_seed is not None:
+            self.seed_random(mcl_seed);
+        if threaded_mcl:
+            self.mcl_worker = MCLWorker(self);
+            self.mcl_worker.start();
         #self.reset_particles();
     
     def render(self):
         
+        if self.mixture_stale:
+            self.mixture_stale = False;
+            self.update_gaussians();
+        self.set_layer('mixture');
         for i in range(len(self.mixture)):
             weight, mean, covariance = self.mixture[i];
             if weight >= self.mixture_mean_weight / 2:
@@ -28,10 +73,11 @@ class MCLSimulation(ObservationSimulation):
                 u = w[0] / np.linalg.norm(w[0]);
                 rads = np.arctan(u[1] / u[0])
                 points = poly_oval(mean[0] - v[0] / 2, mean[1] - v[1] / 2, mean[0] + v[0] / 2, mean[1] + v[1] /2, steps=20, rads=rads);
-                self.draw_polygon(*points, fill='#F' + str(9 - int(weight * 10)) * 2, outline='');
+                self.draw_polygon(*points, fill='#F' + str(max(0, 9 - int(weight * 10))) * 2, outline='');
         
         ObservationSimulation.render(self);
         
+        self.set_layer('particles');
         if self.view_particles:
             radius = 8 / max(1, Simulation.ZOOM_FACTOR ** self.zoom);
             line_length = 30 / max(1, Simulation.ZOOM_FACTOR ** self.zoom);
@@ -40,76 +86,223 @@ class MCLSimulation(ObservationSimulation):
             x, y = self.location;
             s = self.view_size / 2;
             points = [(x + s, y), (x + s + line_length * 1.5, y)];
-            points = map(lambda x: self.rotate_transform(*x, rotation=self.orientation, about=self.location), points);
-            self.draw_line(points[0][0], points[0][1], points[1][0], points[1][1], width=2);
+            self.draw_polygon(self.rotate_points(points, rotation=self.orientation, about=self.location), width=2);
 
-            max_weight = self.mcl.get_max_weight();
-            min_weight = self.mcl.get_min_weight();
-            count = 0;
-            for particle in self.mcl.get_particles():
-                count += 1;
-                if (self.count + count) % 1 != 0:
-                    continue;
-                particle_scale = (particle.get_weight() - min_weight) / max_weight;
-                radius_scale = max(1, (particle_scale) * max_weight_scale);
-                
-                position = particle.get_position();
-                orientation_offset = particle.get_orientation_offset();
-                
-                self.draw_circle(position[0], position[1], radius * radius_scale, fill='red', outline='');
-                line_offset = self.rotate_transform(radius * radius_scale, 0, rotation=(self.orientation - orientation_offset[0]), about=(0, 0));
-                
-                self.draw_line(position[0] + line_offset[0], position[1] + line_offset[1], *self.rotate_transform(position[0] + radius + line_length, position[1], rotation=(self.orientation - orientation_offset[0]), about=position))
+            snapshot = self.get_snapshot();
+            nearby = self.query_view(self.get_particle_index(snapshot), radius * max_weight_scale + line_length);
+            canvas_positions = self.transform_points(snapshot.positions[nearby]);
+            on_screen = ((canvas_positions[:, 0] >= 0) & (canvas_positions[:, 0] < self.canvas_width)
+                         & (canvas_positions[:, 1] >= 0) & (canvas_positions[:, 1] < self.canvas_height));
+            if self.density_particles and on_screen.sum() > self.particle_glyph_threshold:
+                self.particle_view_mode = 'density';
+                self.draw_density(canvas_positions[on_screen]);
+                return;
+            self.particle_view_mode = 'glyphs';
+            
+            weights = snapshot.weights;
+            positions = snapshot.positions[nearby];
+            particle_scales = (weights[nearby] - weights.min()) / weights.max();
+            radii = radius * np.maximum(1, particle_scales * max_weight_scale);
+            rads = np.radians(self.orientation - snapshot.orientation_offsets[nearby]);
+            cos, sin = np.cos(rads), np.sin(rads);
+            starts = positions + np.column_stack((radii * cos, radii * sin));
+            ends = positions + np.column_stack(((radius + line_length) * cos, (radius + line_length) * sin));
+            
+            self.draw_circles(positions, radii, fill='red', outline='');
+            self.draw_lines(starts, ends);
+    
+    def get_particle_index(self, snapshot):
+        # Rebuilt once per particle update; the positions array's identity catches restored or replaced sets
+        # whose version happens to match
+        key = (snapshot.version, id(snapshot.positions));
+        if key != self.particle_index_key:
+            self.particle_index.build(snapshot.positions);
+            self.particle_index_key = key;
+        return self.particle_index;
+    
+    def draw_density(self, canvas_positions):
+        cell = self.density_cell_size;
+        cells = (canvas_positions // cell).astype(np.int64);
+        low = cells.min(axis=0);
+        shape = cells.max(axis=0) - low + 1;
+        counts = np.bincount((cells[:, 1] - low[1]) * shape[0] + (cells[:, 0] - low[0]),
+                             minlength=shape[0] * shape[1]).reshape(shape[1], shape[0]);
+        alpha = np.log1p(counts) / np.log1p(counts.max()) * 230;
+        rgba = np.empty(counts.shape + (4,), dtype=np.uint8);
+        rgba[:, :, :3] = MCLSimulation.DENSITY_COLOR;
+        rgba[:, :, 3] = np.where(counts > 0, np.maximum(alpha, 40), 0);
+        rgba = np.repeat(np.repeat(rgba, cell, axis=0), cell, axis=1);
+        self.draw_image(low[0] * cell, low[1] * cell, rgba);
     
     def reset_particles(self):
-        for particle in self.mcl.particles:
-            particle.set_position(self.location);
-            particle.set_orientation_offset([0]);
+        location = tuple(self.location);
+        def reset(mcl):
+            mcl.set_positions(location);
+            mcl.set_orientation_offsets(0);
+        self.run_mcl(reset);
+    
+    def run_mcl(self, command):
+        if self.mcl_worker is None:
+            command(self.mcl);
+        else:
+            self.mcl_worker.submit(command);
+    
+    def observe_mcl(self, resample=False):
+        if self.mcl_worker is None:
+            self.mcl.observe(self.potential_locations, resample);
+        else:
+            self.mcl_worker.submit_observation(self.potential_locations, resample);
+    
+    def sync_mcl(self):
+        if self.mcl_worker is not None:
+            self.mcl_worker.wait();
+    
+    def get_search_region(self):
+        snapshot = self.get_snapshot();
+        return self.get_particle_search_region(snapshot.positions, snapshot.weights);
+    
+    def get_snapshot(self):
+        if self.mcl_worker is None:
+            return MCLSnapshot(self.mcl, copy=False);
+        return self.mcl_worker.get_snapshot();
     
     def on_move(self, translation):
-        self.mcl.translate(*translation);
+        self.run_mcl(lambda mcl: mcl.translate(*translation));
         if self.auto_mcl:
-            self.mcl.update_weights(self.potential_locations);
+            self.observe_mcl();
     
     def on_rotate(self, rotation):
-        self.mcl.rotate(rotation);
+        self.run_mcl(lambda mcl: mcl.rotate(rotation));
         
     def on_view(self, changed):
         ObservationSimulation.on_view(self, changed);
-        self.update_gaussians();
+        if self.mcl_worker is None:
+            # The mixture is only drawn, so headless runs fit it when a frame is rendered instead
+            if self.headless:
+                self.mixture_stale = True;
+            else:
+                self.update_gaussians();
         if len(self.visible) and (changed or not self.update_on_view_change_only) and self.auto_mcl:
             #print ', '.join(map(lambda x: str(self.location_encoding_model.observe(x)) + ' ' + str(x), self.visible));
-            self.mcl.resample();
-            self.mcl.update_weights(self.potential_locations);
+            self.observe_mcl(resample=True);
     
     def update_gaussians(self):
-        mix = mixture.BayesianGaussianMixture(n_components=4);
-        mix.fit(self.mcl.get_positions());
-        self.mixture = sorted(zip(mix.weights_, mix.means_, mix.covariances_));
-        self.mixture_mean_weight = np.mean(mix.weights_);
+        if not self.incremental_mixture:
+            start = time.time();
+            mix = mixture.BayesianGaussianMixture(n_components=MCLSimulation.MIXTURE_COMPONENTS);
+            mix.fit(self.mcl.get_positions());
+            self.set_mixture(mix.weights_, mix.means_, mix.covariances_);
+            self.mixture_fit_time = time.time() - start;
+            self.mixture_method = 'gmm';
+            return;
+        if self.mixture_version == self.mcl.version:
+            return;
+        self.mixture_version = self.mcl.version;
+        
+        positions = self.mcl.get_positions();
+        if len(positions) > self.mixture_sample_size:
+            positions = positions[self.mixture_random.choice(len(positions), self.mixture_sample_size, replace=False)];
+        if self.mixture_skips > 0:
+            self.mixture_skips -= 1;
+            self.fit_moments(positions);
+            return;
+        
+        start = time.time();
+        if self.mixture_model is None:
+            self.mixture_model = mixture.BayesianGaussianMixture(n_components=MCLSimulation.MIXTURE_COMPONENTS, warm_start=True);
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', ConvergenceWarning);
+            self.mixture_model.fit(positions);
+        self.set_mixture(self.mixture_model.weights_, self.mixture_model.means_, self.mixture_model.covariances_);
+        self.mixture_fit_time = time.time() - start;
+        self.mixture_method = 'gmm';
+        if self.mixture_fit_time * 1000 > self.mixture_budget:
+            self.mixture_skips = self.mixture_backoff;
+    
+    def fit_moments(self, positions, iterations=3):
+        start = time.time();
+        k = MCLSimulation.MIXTURE_COMPONENTS;
+        if len(self.mixture) == k:
+            means = np.array([mean for _, mean, _ in self.mixture]);
+        else:
+            means = positions[self.mixture_random.choice(len(positions), k, replace=len(positions) < k)];
+        for _ in range(iterations):
+            distances = ((positions[:, np.newaxis, :] - means[np.newaxis, :, :]) ** 2).sum(axis=2);
+            labels = distances.argmin(axis=1);
+            for c in range(k):
+                if (labels == c).any():
+                    means[c] = positions[labels == c].mean(axis=0);
+        weights = np.bincount(labels, minlength=k) / float(len(positions));
+        covariances = np.array([np.cov(positions[labels == c].T) if (labels == c).sum() > 2 else np.zeros((2, 2))
+                                for c in range(k)]) + np.eye(2);
+        self.set_mixture(weights, means, covariances);
+        self.mixture_fit_time = time.time() - start;
+        self.mixture_method = 'moments';
+    
+    def set_mixture(self, weights, means, covariances):
+        self.mixture = sorted(zip(weights, means, covariances), key=lambda component: component[0]);
+        self.mixture_mean_weight = np.mean(weights);
             
     def key_down(self, event):
         if event.keysym == 'm':
             self.auto_mcl = not self.auto_mcl;
         if event.keysym == 'b':
             self.view_particles = not self.view_particles;
+        if event.keysym == 'g':
+            self.density_particles = not self.density_particles;
         if event.keysym == 'j':
-            self.mcl.resample();
+            self.run_mcl(lambda mcl: mcl.resample());
         if event.keysym == 't':
-            self.location = tuple(np.random.rand(2) * (self.width, self.height));
+            self.location = tuple(self.random.rand(2) * (self.width, self.height));
         ObservationSimulation.key_down(self, event);
         
     def key_event(self, keysyms):
         if 'x' in keysyms:
             self.reset_particles();
         if 'u' in keysyms:
-            self.mcl.update_weights(self.potential_locations);
+            self.observe_mcl();
         ObservationSimulation.key_event(self, keysyms);
         
+    def get_profiled_hooks(self):
+        return ObservationSimulation.get_profiled_hooks(self) + ['update_gaussians', 'observe_mcl'];
+    
+    def seed_random(self, seed):
+        ObservationSimulation.seed_random(self, seed);
+        self.run_mcl(lambda mcl: mcl.random.seed([seed, 1]));
+        self.mixture_random.seed([seed, 2]);
+    
+    def get_trace_state(self):
+        self.sync_mcl();
+        state = ObservationSimulation.get_trace_state(self);
+        state.update({'auto_mcl': self.auto_mcl,
+                      'update_on_view_change_only': self.update_on_view_change_only,
+                      'view_particles': self.view_particles,
+                      'density_particles': self.density_particles});
+        state.update(('mcl.' + name, value) for name, value in self.mcl.get_state().items());
+        return state;
+    
+    def set_trace_state(self, state):
+        ObservationSimulation.set_trace_state(self, state);
+        for name in ['auto_mcl', 'update_on_view_change_only', 'view_particles', 'density_particles']:
+            setattr(self, name, state[name].item());
+        mcl_state = dict((name[len('mcl.'):], value) for name, value in state.items() if name.startswith('mcl.'));
+        self.run_mcl(lambda mcl: mcl.set_state(mcl_state));
+        self.mixture_version = None;
+    
+    def get_trace_observation(self, particles):
+        observation = ObservationSimulation.get_trace_observation(self, particles);
+        if particles:
+            snapshot = self.get_snapshot();
+            observation.update({'positions': snapshot.positions.astype(np.float32),
+                                'orientation_offsets': snapshot.orientation_offsets.astype(np.float32),
+                                'weights': snapshot.weights.astype(np.float32)});
+        return observation;
+    
     def get_instructions(self):
         instructions = ObservationSimulation.get_instructions(self);
         return instructions + [['Toggle auto MCL - M',
                                 'Toggle view particles - B',
+                                'Toggle particle density - G',
                                 'Update particle weights - U',
                                 'Resample particles - J',
                                 'Reset particles - X',
@@ -117,10 +310,21 @@ class MCLSimulation(ObservationSimulation):
     
     def get_status(self):
         status = ObservationSimulation.get_status(self);
-        return status + [['Rotation error: ' + str(self.mcl.rotation_error),
-                          'Translation error: ' + str((self.mcl.translation_magnitude_error, self.mcl.translation_direction_error)),
-                          'Variance: ' + str(self.mcl.get_variance()),
-                          'Particles: ' + str(len(self.mcl.particles))]];
+        snapshot = self.get_snapshot();
+        status = status + [['Rotation error: ' + str(self.mcl.rotation_error),
+                            'Translation error: ' + str((self.mcl.translation_magnitude_error, self.mcl.translation_direction_error)),
+                            'Variance: ' + str(snapshot.variance),
+                            'Resampled: ' + str(self.mcl.resample_count) + ' of ' + str(self.mcl.observation_count) + ' observations ('
+                            + self.mcl.resample_policy + ', ESS ' + str(int(1.0 / np.dot(snapshot.weights, snapshot.weights))) + ')',
+                            'Particles: ' + str(snapshot.count) + ' (' + self.particle_view_mode + ')'
+                            + ('' if self.mcl.sampler is None else ', ' + self.mcl.sampler.get_decision())
+                            + ('' if not self.mcl.injected else ', ' + str(self.mcl.injected) + ' injected'),
+                            'Mixture fit: ' + str(int(self.mixture_fit_time * 1000)) + 'ms (' + self.mixture_method + ')']];
+        if self.mcl_worker is not None:
+            status[-1].append('MCL lag: ' + str(self.mcl_worker.get_pending()) + ' pending, '
+                              + str(int((time.time() - snapshot.timestamp) * 1000)) + 'ms old, '
+                              + str(self.mcl_worker.coalesced) + ' coalesced');
+        return status;
     
     
 def poly_oval(x0, y0, x1, y1, steps=20, rads=0):
@@ -0,0 +1,113 @@
+import time
+import sys
+import atexit
+import threading
+
+class MCLSnapshot:
+    
+    def __init__(self, mcl, sequence=0, copy=True):
+        self.positions = mcl.get_positions().copy() if copy else mcl.get_positions();
+        self.orientation_offsets = mcl.get_orientation_offsets().copy() if copy else mcl.get_orientation_offsets();
+        self.weights = mcl.get_weights().copy() if copy else mcl.get_weights();
+        self.variance = mcl.get_variance();
+        self.count = mcl.get_count();
+        self.version = mcl.version;
+        self.sequence = sequence;
+        self.timestamp = time.time();
+
+class MCLWorker(threading.Thread):
+    
+    def __init__(self, simulation):
+        threading.Thread.__init__(self);
+        self.daemon = True;
+        self.simulation = simulation;
+        self.condition = threading.Condition();
+        self.commands = [];
+        self.observation = None;
+        self.submitted = 0;
+        self.completed = 0;
+        self.coalesced = 0;
+        self.busy = False;
+        self.running = True;
+        self.error = None;
+        self.snapshot = MCLSnapshot(simulation.mcl);
+        atexit.register(self.stop);
+    
+    def submit(self, command):
+        with self.condition:
+            self.submitted += 1;
+            self.commands.append(command);
+            self.condition.notify_all();
+    
+    def submit_observation(self, locations, resample=False):
+        with self.condition:
+            self.submitted += 1;
+            if self.observation is not None:
+                # Latest wins, but a dropped observation's pending resample still has to happen
+                resample = resample or self.observation[1];
+                self.coalesced += 1;
+                self.completed += 1;
+            self.observation = (list(locations), resample);
+            self.condition.notify_all();
+    
+    def get_pending(self):
+        with self.condition:
+            return self.submitted - self.completed;
+    
+    def wait(self):
+        with self.condition:
+            while (self.commands or self.observation is not None or self.busy) and self.error is None:
+                self.condition.wait();
+            self.raise_error();
+    
+    def get_snapshot(self):
+        with self.condition:
+            self.raise_error();
+            return self.snapshot;
+    
+    def raise_error(self):
+        # A failed batch stops the worker; the failure resurfaces on the simulation's thread from then on
+        if self.error is not None:
+            error_type, error, traceback = self.error;
+            raise error_type, error, traceback;
+    
+    def stop(self):
+        with self.condition:
+            self.running = False;
+            self.condition.notify_all();
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join();
+    
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.commands and self.observation is None:
+                    self.condition.wait();
+                if not self.running:
+                    return;
+                commands, self.commands = self.commands, [];
+                observation, self.observation = self.observation, None;
+                self.busy = True;
+            
+            snapshot = None;
+            try:
+                mcl = self.simulation.mcl;
+                for command in commands:
+                    command(mcl);
+                if observation is not None:
+                    mcl.observe(*observation);
+                self.simulation.update_gaussians();
+                snapshot = MCLSnapshot(mcl, self.snapshot.sequence + 1);
+            except:
+                with self.condition:
+                    self.error = sys.exc_info();
+                    self.running = False;
+            finally:
+                with self.condition:
+                    if snapshot is not None:
+                        self.snapshot = snapshot;
+                        self.completed += len(commands) + (observation is not None);
+                    self.busy = False;
+                    self.condition.notify_all();
+            if snapshot is None:
+                return;
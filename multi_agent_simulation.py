@@ -0,0 +1,278 @@
+import math
+import time
+import numpy as np
+
+from simulation import Simulation
+from camera_simulation import CameraSimulation
+from observation_simulation import ObservationSimulation
+from locationencodingmodel import *
+from arraymcl import StackedMCL
+from spatial_index import GridIndex
+
+class MultiAgentSimulation(ObservationSimulation):
+    
+    AGENT_COLORS = ['#e6194b', '#3cb44b', '#4363d8', '#f58231', '#911eb4', '#42d4f4', '#f032e6', '#9a6324'];
+    
+    def __init__(self, width, height, rotation=0, location_encoding_model_type=RandomModel, title='MultiAgentSimulation', headless=False, retained=True,
+                 agent_count=8, particle_count=500, agent_speed=20, agent_turn_rate=15, resample_threshold=0.5,
+                 particle_glyph_limit=2000, seed=None, **kwargs):
+        ObservationSimulation.__init__(self, width, height, rotation, location_encoding_model_type=location_encoding_model_type, title=title, headless=headless, retained=retained, **kwargs);
+        # Every agent shares self.location_encoding_model; the selected agent is also the camera that the
+        # inherited key bindings drive, so self.location and self.orientation mirror its pose
+        self.random = np.random.RandomState(seed);
+        margin = self.view_size;
+        self.agent_locations = margin + self.random.rand(agent_count, 2) * (self.width - 2 * margin, self.height - 2 * margin);
+        self.agent_locations[0] = self.location;
+        self.agent_orientations = np.full(agent_count, float(self.orientation));
+        self.agent_headings = self.random.uniform(-180, 180, agent_count);
+        self.agent_speed = agent_speed;
+        self.agent_turn_rate = agent_turn_rate;
+        self.pending_translations = np.zeros((agent_count, 2));
+        self.pending_rotations = np.zeros(agent_count);
+        self.agent_visible = [set() for _ in range(agent_count)];
+        self.agent_potential_groups = [[] for _ in range(agent_count)];
+        self.agent_potential_locations = [[] for _ in range(agent_count)];
+        self.agent_observation_offsets = np.zeros((agent_count, 2));
+        self.mcl = StackedMCL(agent_count, particle_count, (self.width, self.height), resample_threshold=resample_threshold, seed=seed);
+        self.selected = 0;
+        self.show_all = True;
+        self.autopilot = True;
+        self.view_particles = True;
+        self.particle_glyph_limit = particle_glyph_limit;
+        self.particle_index = GridIndex(ObservationSimulation.INDEX_BUCKET_SIZE);
+        self.particle_index_key = None;
+        self.update_time = 0.0;
+        self.update_agents();
+    
+    def get_agent_count(self):
+        return len(self.agent_locations);
+    
+    def loop(self):
+        ObservationSimulation.loop(self);
+        if self.autopilot:
+            self.move_agents();
+        self.update_agents();
+    
+    def move_agents(self):
+        # Every agent but the selected one wanders, turning back when its camera would leave the grid
+        wandering = np.arange(self.get_agent_count()) != self.selected;
+        self.agent_headings[wandering] += self.random.normal(0, self.agent_turn_rate, wandering.sum());
+        rads = np.radians(self.agent_headings);
+        steps = self.agent_speed * np.column_stack((np.cos(rads), np.sin(rads)));
+        targets = self.agent_locations + steps;
+        margin = self.view_size;
+        blocked = ((targets < margin) | (targets > (self.width - margin, self.height - margin))).any(axis=1);
+        self.agent_headings[wandering & blocked] += 180;
+        steps[~wandering | blocked] = 0;
+        self.agent_locations += steps;
+        self.pending_translations += steps;
+    
+    def update_visible(self):
+        # Key movement of the selected agent is folded into the next batched update
+        self.agent_locations[self.selected] = self.location;
+        self.agent_orientations[self.selected] = self.orientation;
+    
+    def on_move(self, translation):
+        self.pending_translations[self.selected] += translation;
+    
+    def on_rotate(self, rotation):
+        self.pending_rotations[self.selected] += rotation;
+    
+    def update_agents(self):
+        start = time.time();
+        moved = (self.pending_translations != 0).any(axis=1);
+        self.mcl.translate(self.pending_translations);
+        self.mcl.rotate(self.pending_rotations);
+        self.pending_translations[:] = 0;
+        self.pending_rotations[:] = 0;
+        
+        agents, cells = self.compute_visible_batch(self.agent_locations, self.agent_orientations);
+        old_visible = self.agent_visible;
+        self.agent_visible = [set() for _ in range(self.get_agent_count())];
+        for agent, cell in zip(agents.tolist(), map(tuple, cells.tolist())):
+            self.agent_visible[agent].add(cell);
+        changed = np.array([new != old for new, old in zip(self.agent_visible, old_visible)]);
+        
+        # The first visible cell of each agent is its master; all codes come from one observe_array call
+        codes = self.location_encoding_model.observe_array(cells[:, 0], cells[:, 1]);
+        self.update_search_region();
+        bounds = np.searchsorted(agents, np.arange(self.get_agent_count() + 1));
+        seeing = np.nonzero(bounds[1:] > bounds[:-1])[0];
+        masters = bounds[seeing];
+        possibilities = self.match_batch(
+            codes[masters].tolist(),
+            [cells[bounds[a] + 1:bounds[a + 1]] - cells[bounds[a]] for a in seeing],
+            [codes[bounds[a] + 1:bounds[a + 1]] for a in seeing]);
+        
+        self.agent_potential_groups = [[] for _ in range(self.get_agent_count())];
+        self.agent_potential_locations = [[] for _ in range(self.get_agent_count())];
+        self.agent_observation_offsets[seeing] = cells[masters] * CameraSimulation.CELL_SIZE - self.agent_locations[seeing];
+        for agent, matches in zip(seeing, possibilities):
+            offsets = cells[bounds[agent]:bounds[agent + 1]] - cells[bounds[agent]];
+            groups = matches[:, np.newaxis, :] + offsets[np.newaxis, :, :];
+            self.agent_potential_groups[agent] = [map(tuple, group) for group in groups.tolist()];
+            self.agent_potential_locations[agent] = matches * CameraSimulation.CELL_SIZE - self.agent_observation_offsets[agent];
+        
+        # Like MCLSimulation: every move is observed, and a changed view may also resample
+        observing = [agent for agent in seeing if (moved[agent] or changed[agent]) and len(self.agent_potential_locations[agent])];
+        if observing:
+            self.mcl.update_weights(np.concatenate([np.full(len(self.agent_potential_locations[a]), a) for a in observing]),
+                                    np.concatenate([self.agent_potential_locations[a] for a in observing]));
+            self.mcl.resample_if_needed([agent for agent in observing if changed[agent]]);
+        self.update_time = time.time() - start;
+        self.share_selected();
+    
+    def share_selected(self):
+        # The inherited rendering and status read the single-camera fields
+        self.visible = self.agent_visible[self.selected];
+        self.observation_offset = tuple(self.agent_observation_offsets[self.selected]);
+        shown = range(self.get_agent_count()) if self.show_all else [self.selected];
+        self.potential_groups = [group for agent in shown for group in self.agent_potential_groups[agent]];
+        self.potential_locations = [tuple(location) for agent in shown for location in np.reshape(self.agent_potential_locations[agent], (-1, 2)).tolist()];
+    
+    def select_agent(self, agent):
+        self.selected = agent % self.get_agent_count();
+        self.location = tuple(self.agent_locations[self.selected]);
+        self.orientation = float(self.agent_orientations[self.selected]);
+        self.rotation = -self.orientation;
+        self.share_selected();
+    
+    def pre_render(self):
+        ObservationSimulation.pre_render(self);
+        if not self.show_all:
+            return;
+        self.set_layer('agents');
+        view_size = self.view_size / 2;
+        for agent in range(self.get_agent_count()):
+            if agent == self.selected:
+                continue;
+            for i, j in self.agent_visible[agent]:
+                corners = self.get_cell_corners((i, j))[0];
+                self.draw_polygon(np.vstack((corners, corners[:1])), fill='#b5ecd2');
+            x, y = self.agent_locations[agent];
+            points = [(x - view_size, y - view_size), (x + view_size, y - view_size), (x + view_size, y + view_size), (x - view_size, y + view_size)];
+            points = self.rotate_points(points, rotation=self.agent_orientations[agent], about=(x, y));
+            self.draw_polygon(np.vstack((points, points[:1])), outline=self.get_agent_color(agent), width=2);
+    
+    def render(self):
+        ObservationSimulation.render(self);
+        
+        self.set_layer('particles');
+        if not self.view_particles:
+            return;
+        shown = range(self.get_agent_count()) if self.show_all else [self.selected];
+        # Large fleets would flood the canvas, so a regular subsample of each set is drawn
+        stride = max(1, int(math.ceil(len(shown) * self.mcl.get_count() / float(self.particle_glyph_limit))));
+        radius = 4 / max(1, Simulation.ZOOM_FACTOR ** self.zoom);
+        count = self.mcl.get_count();
+        nearby = self.query_view(self.get_particle_index(), radius);
+        nearby = nearby[nearby % count % stride == 0];
+        # Flattened indices are agent-major and come back sorted, so each agent's particles are one slice
+        bounds = np.searchsorted(nearby, np.arange(self.get_agent_count() + 1) * count);
+        positions = self.mcl.positions.reshape(-1, 2);
+        estimates, _ = self.mcl.get_estimates();
+        for agent in shown:
+            color = self.get_agent_color(agent);
+            self.draw_circles(positions[nearby[bounds[agent]:bounds[agent + 1]]], radius, fill=color, outline='');
+            self.draw_circles(estimates[agent:agent + 1], radius * 3, outline=color, width=2);
+    
+    def get_search_region(self):
+        # One region serves the whole batch, so it covers every agent's particles
+        return self.get_particle_search_region(self.mcl.positions.reshape(-1, 2), self.mcl.weights.ravel());
+    
+    def get_particle_index(self):
+        key = (self.mcl.version, id(self.mcl.positions));
+        if key != self.particle_index_key:
+            self.particle_index.build(self.mcl.positions.reshape(-1, 2));
+            self.particle_index_key = key;
+        return self.particle_index;
+    
+    def get_agent_color(self, agent):
+        return MultiAgentSimulation.AGENT_COLORS[agent % len(MultiAgentSimulation.AGENT_COLORS)];
+    
+    def get_errors(self):
+        estimates, _ = self.mcl.get_estimates();
+        return np.hypot(*(estimates - self.agent_locations).T);
+    
+    def key_down(self, event):
+        if event.keysym == 'n':
+            self.select_agent(self.selected + 1);
+        if event.keysym == 'h':
+            self.show_all = not self.show_all;
+            self.keep_centered = not self.show_all;
+            self.share_selected();
+        if event.keysym == 'k':
+            self.autopilot = not self.autopilot;
+        if event.keysym == 'b':
+            self.view_particles = not self.view_particles;
+        ObservationSimulation.key_down(self, event);
+    
+    def get_profiled_hooks(self):
+        return ObservationSimulation.get_profiled_hooks(self) + ['move_agents', 'update_agents'];
+    
+    def seed_random(self, seed):
+        ObservationSimulation.seed_random(self, seed);
+        self.mcl.random.seed([seed, 1]);
+    
+    def get_agent_visible_array(self):
+        return np.array(sorted((agent, i, j) for agent in range(self.get_agent_count()) for i, j in self.agent_visible[agent]),
+                        dtype=np.int32).reshape(-1, 3);
+    
+    def get_trace_state(self):
+        state = ObservationSimulation.get_trace_state(self);
+        state.update({'agent_locations': self.agent_locations,
+                      'agent_orientations': self.agent_orientations,
+                      'agent_headings': self.agent_headings,
+                      'agent_observation_offsets': self.agent_observation_offsets,
+                      'pending_translations': self.pending_translations,
+                      'pending_rotations': self.pending_rotations,
+                      'agent_visible': self.get_agent_visible_array(),
+                      'selected': self.selected,
+                      'show_all': self.show_all,
+                      'autopilot': self.autopilot,
+                      'view_particles': self.view_particles});
+        state.update(('mcl.' + name, value) for name, value in self.mcl.get_state().items());
+        return state;
+    
+    def set_trace_state(self, state):
+        # The replay may have been built with another agent_count, so every per-agent field takes the
+        # checkpoint's size
+        ObservationSimulation.set_trace_state(self, state);
+        for name in ['agent_locations', 'agent_orientations', 'agent_headings', 'agent_observation_offsets',
+                     'pending_translations', 'pending_rotations']:
+            setattr(self, name, np.array(state[name], dtype=float));
+        self.agent_visible = [set() for _ in range(self.get_agent_count())];
+        self.agent_potential_groups = [[] for _ in range(self.get_agent_count())];
+        self.agent_potential_locations = [[] for _ in range(self.get_agent_count())];
+        for agent, i, j in state['agent_visible'].tolist():
+            self.agent_visible[agent].add((i, j));
+        for name in ['selected', 'show_all', 'autopilot', 'view_particles']:
+            setattr(self, name, state[name].item());
+        self.mcl.set_state(dict((name[len('mcl.'):], value) for name, value in state.items() if name.startswith('mcl.')));
+        self.share_selected();
+    
+    def get_trace_observation(self, particles):
+        observation = ObservationSimulation.get_trace_observation(self, particles);
+        observation['visible'] = self.get_agent_visible_array();
+        if particles:
+            observation.update({'positions': self.mcl.positions.astype(np.float32),
+                                'orientation_offsets': self.mcl.orientation_offsets.astype(np.float32),
+                                'weights': self.mcl.weights.astype(np.float32)});
+        return observation;
+    
+    def get_instructions(self):
+        instructions = ObservationSimulation.get_instructions(self);
+        return instructions + [['Follow next agent - N',
+                                'Toggle all agents / followed agent - H',
+                                'Toggle autopilot - K',
+                                'Toggle view particles - B']];
+    
+    def get_status(self):
+        status = ObservationSimulation.get_status(self);
+        errors = self.get_errors();
+        count = self.get_agent_count();
+        return status + [['Agents: ' + str(count) + (' (all shown' if self.show_all else ' (following') + ', agent ' + str(self.selected) + ' selected)',
+                          'Particles: ' + str(count) + ' x ' + str(self.mcl.get_count()),
+                          'Batched update: ' + str(round(self.update_time * 1000, 1)) + 'ms (' + str(round(self.update_time * 1000 / count, 2)) + 'ms per agent)',
+                          'Error: ' + str(int(errors[self.selected])) + ' selected, ' + str(int(np.median(errors))) + ' median',
+                          'Resampled: ' + str(int(self.mcl.resample_counts.sum())) + ' of ' + str(int(self.mcl.observation_counts.sum())) + ' observations']];
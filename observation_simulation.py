@@ -1,16 +1,33 @@
 import math
+import numpy as np
 
 from simulation import Simulation
 from camera_simulation import CameraSimulation
 from locationencodingmodel import *
+from spatial_index import GridIndex
     
 class ObservationSimulation(CameraSimulation):
     
-    def __init__(self, width, height, rotation=0, location_encoding_model_type=RandomModel, title='ObservationSimulation', **kwargs):
-        CameraSimulation.__init__(self, width, height, rotation, title=title);
-        self.location_encoding_model = location_encoding_model_type(self.grid_width, self.grid_height, **kwargs);
+    INDEX_BUCKET_SIZE = 4 * CameraSimulation.CELL_SIZE;
+    
+    def __init__(self, width, height, rotation=0, location_encoding_model_type=RandomModel, title='ObservationSimulation', headless=False, retained=True,
+                 patch_index_budget=None, location_encoding_model=None, match_cache_budget=32 << 20, **kwargs):
+        CameraSimulation.__init__(self, width, height, rotation, title=title, headless=headless, retained=retained);
+        if location_encoding_model is None:
+            location_encoding_model = location_encoding_model_type(self.grid_width, self.grid_height, **kwargs);
+        elif (location_encoding_model.n, location_encoding_model.m) != (self.grid_width, self.grid_height):
+            raise ValueError('Location encoding model is ' + str(location_encoding_model.n) + ' x ' + str(location_encoding_model.m)
+                             + ' but the grid is ' + str(self.grid_width) + ' x ' + str(self.grid_height));
+        self.location_encoding_model = location_encoding_model;
+        if patch_index_budget is not None:
+            self.location_encoding_model.enable_patch_index(patch_index_budget);
+        self.match_cache = None if match_cache_budget is None else MatchCache(match_cache_budget);
         self.potential_groups = [];
         self.potential_locations = [];
+        self.candidate_source = (None, None);
+        self.candidate_cells = np.zeros((0, 2), dtype=np.int64);
+        self.candidate_cell_index = GridIndex(ObservationSimulation.INDEX_BUCKET_SIZE);
+        self.candidate_location_index = GridIndex(ObservationSimulation.INDEX_BUCKET_SIZE);
         self.view_data = False;
         
     def render(self):
@@ -19,45 +36,54 @@ class ObservationSimulation(CameraSimulation):
         scale = self.scale * Simulation.ZOOM_FACTOR ** self.zoom;
         edge = CameraSimulation.CELL_SIZE * scale;
         
-        def highlight_square(i, j, fill='#bbbbbb'):
-            tl = (float(self.width)/self.grid_width*(i), 
-                  float(self.height)/self.grid_height*(j));
-            tr = (tl[0] + CameraSimulation.CELL_SIZE, tl[1]);
-            br = (tl[0] + CameraSimulation.CELL_SIZE, tl[1] + CameraSimulation.CELL_SIZE);
-            bl = (tl[0], tl[1] + CameraSimulation.CELL_SIZE);
-            center = (tl[0] + CameraSimulation.CELL_SIZE / 2, tl[1] + CameraSimulation.CELL_SIZE / 2);
-            transformed = self.transform(center[0], center[1]);
-            if transformed[0] + edge > 0 and transformed[0] - edge < self.canvas_width and transformed[1] + edge> 0 and transformed[1] - edge < self.canvas_height:
-                points = [tl, tr, br, bl];
-                self.draw_polygon(*(points + [points[0]]), fill=fill);
-                
-        cells = set();
-        for potential_group in self.potential_groups:
-            for cell in potential_group:
-                cells.add(cell);
-        for cell in cells:
-            if cell not in self.visible:
-                highlight_square(cell[0], cell[1]);
+        def on_screen(cells):
+            transformed = self.transform_points(self.get_cell_centers(cells));
+            return ((transformed[:, 0] + edge > 0) & (transformed[:, 0] - edge < self.canvas_width)
+                    & (transformed[:, 1] + edge > 0) & (transformed[:, 1] - edge < self.canvas_height));
+        
+        self.refresh_candidate_index();
+        self.set_layer('candidates');
+        cells = self.candidate_cells[self.query_view(self.candidate_cell_index, CameraSimulation.CELL_SIZE)];
+        cells = np.array([cell for cell in map(tuple, cells.tolist()) if cell not in self.visible]).reshape(-1, 2);
+        for corners in self.get_cell_corners(cells[on_screen(cells)]):
+            self.draw_polygon(np.vstack((corners, corners[:1])), fill='#bbbbbb');
                 
-        for potential_location in self.potential_locations:
-            self.draw_circle(*potential_location, radius=15 / max(1, Simulation.ZOOM_FACTOR ** self.zoom), fill='green');
+        self.set_layer('candidate_locations');
+        radius = 15 / max(1, Simulation.ZOOM_FACTOR ** self.zoom);
+        locations = np.array(self.potential_locations, dtype=float).reshape(-1, 2);
+        self.draw_circles(locations[self.query_view(self.candidate_location_index, radius)], radius, fill='green');
         
         font_size_quadratic = int(math.sqrt(scale * CameraSimulation.CELL_SIZE * 6));
         font_size_linear = int(scale * CameraSimulation.CELL_SIZE * 0.4);
         font_size = min(font_size_linear, font_size_quadratic);
         if self.view_data and font_size >= 6:
-            for i in range(self.grid_width):
-                for j in range(self.grid_height):
-                    center = (float(self.width)/self.grid_width*(i)
-                              + CameraSimulation.CELL_SIZE / 2, 
-                              float(self.height)/self.grid_height*(j)
-                              + CameraSimulation.CELL_SIZE / 2);
-                    transformed = self.transform(center[0], center[1]);
-                    if transformed[0] + edge > 0 and transformed[0] - edge < self.canvas_width and transformed[1] + edge> 0 and transformed[1] - edge < self.canvas_height:
-                        self.canvas.create_text(transformed[0], transformed[1],
-                                                text=self.location_encoding_model.observe((i, j)),
-                                                font=(None, font_size));
+            mode = self.begin_static_layer('labels', (font_size, id(self.location_encoding_model)));
+            if mode != 'keep':
+                cells = self.get_cells_in_view();
+                cells = cells[on_screen(cells)];
+                keys = map(tuple, cells.tolist());
+                draw = self.get_static_mask(mode, keys);
+                cells = cells[draw];
+                codes = self.location_encoding_model.observe_array(cells[:, 0], cells[:, 1]);
+                for key, (x, y), code in zip([key for key, d in zip(keys, draw) if d],
+                                             self.transform_points(self.get_cell_centers(cells)).tolist(), codes.tolist()):
+                    self.draw_text(x, y, key=key, text=code, font=(None, font_size));
             
+    def query_view(self, index, margin=0):
+        # Indices of the indexed points within margin (world units) of the viewport
+        low_x, low_y, high_x, high_y = self.get_view_bounds();
+        return index.query(low_x - margin, low_y - margin, high_x + margin, high_y + margin);
+        
+    def refresh_candidate_index(self):
+        # on_view replaces the candidate lists rather than editing them, so their identity tells when to rebuild
+        if self.candidate_source[0] is self.potential_groups and self.candidate_source[1] is self.potential_locations:
+            return;
+        self.candidate_source = (self.potential_groups, self.potential_locations);
+        cells = np.array([cell for group in self.potential_groups for cell in group], dtype=np.int64).reshape(-1, 2);
+        self.candidate_cells = np.unique(cells, axis=0) if len(cells) else cells;
+        self.candidate_cell_index.build(self.get_cell_centers(self.candidate_cells));
+        self.candidate_location_index.build(self.potential_locations);
+        
     def on_view(self, changed):
         self.potential_groups = [];
         self.potential_locations = [];
@@ -71,32 +97,52 @@ class ObservationSimulation(CameraSimulation):
             observed = map(lambda x: x * CameraSimulation.CELL_SIZE, group[0]);
             self.observation_offset = (observed[0] - self.location[0], observed[1] - self.location[1]);
 
+            cells = np.array(group);
+            offsets = cells - cells[0];
             data = self.location_encoding_model.observe(master);
-            possibilities = set(self.location_encoding_model.lookup(data));
-
-            for i in range(1, len(group)):
-                di = group[i][0] - master[0];
-                dj = group[i][1] - master[1];
-                d = self.location_encoding_model.observe(group[i]);
-                impossibilities = set();
-                for possibility in possibilities:
-                    if self.location_encoding_model.observe((possibility[0] + di, possibility[1] + dj)) != d:
-                        impossibilities.add(possibility);
-                for impossibility in impossibilities:
-                    possibilities.remove(impossibility);
+            observed = self.location_encoding_model.observe_array(cells[1:, 0], cells[1:, 1]);
+            self.update_search_region();
+            possibilities = self.match(data, offsets[1:], observed);
 
-            for i, j in possibilities:
-                potential_group = [];
-                for k in range(0, len(group)):
-                    di = group[k][0] - master[0];
-                    dj = group[k][1] - master[1];
-                    potential_group.append((i + di, j + dj));
-                self.potential_groups.append(potential_group);
+            potential_groups = possibilities[:, np.newaxis, :] + offsets[np.newaxis, :, :];
+            self.potential_groups = [map(tuple, potential_group) for potential_group in potential_groups.tolist()];
             
-            for group in self.potential_groups:
-                self.potential_locations.append((group[0][0] * CameraSimulation.CELL_SIZE - self.observation_offset[0], 
-                                                 group[0][1] * CameraSimulation.CELL_SIZE - self.observation_offset[1]));
+            potential_locations = possibilities * CameraSimulation.CELL_SIZE - self.observation_offset;
+            self.potential_locations = map(tuple, potential_locations.tolist());
             
+    def update_search_region(self):
+        if isinstance(self.location_encoding_model, TiledModel):
+            region = self.get_search_region();
+            self.location_encoding_model.set_search_region(*(region or (None, None)));
+        
+    def get_search_region(self):
+        # The (low, high) cells a tiled model searches for the master cell, or None for the whole world; the
+        # camera's own pose must not decide it, or the candidates would give the true location away
+        return None;
+        
+    def get_particle_search_region(self, positions, weights):
+        # The particles' bounding box, grown by the view so the master cell stays inside, or the largest square
+        # the model can search at once around their weighted mean when the box is bigger than that
+        margin = int(self.view_size // CameraSimulation.CELL_SIZE) + 1;
+        low = np.floor(positions.min(axis=0) / CameraSimulation.CELL_SIZE).astype(np.int64) - margin;
+        high = np.floor(positions.max(axis=0) / CameraSimulation.CELL_SIZE).astype(np.int64) + margin;
+        limit = self.location_encoding_model.get_region_limit();
+        if np.prod(high - low + 1) > limit:
+            center = np.floor(np.dot(weights, positions) / weights.sum() / CameraSimulation.CELL_SIZE).astype(np.int64);
+            half = int(np.sqrt(limit)) // 2;
+            low, high = center - half, center + half;
+        return tuple(low.tolist()), tuple(high.tolist());
+        
+    def match(self, data, offsets, observed):
+        if self.match_cache is None:
+            return self.location_encoding_model.match(data, offsets, observed);
+        return self.match_cache.match(self.location_encoding_model, data, offsets, observed);
+        
+    def match_batch(self, data, offsets, observed):
+        if self.match_cache is None:
+            return self.location_encoding_model.match_batch(data, offsets, observed);
+        return self.match_cache.match_batch(self.location_encoding_model, data, offsets, observed);
+        
     def key_down(self, event):
         if event.keysym == 'v':
             self.view_data = not self.view_data;
@@ -105,12 +151,53 @@ class ObservationSimulation(CameraSimulation):
     def key_event(self, keysyms):
         CameraSimulation.key_event(self, keysyms);
         
+    def get_trace_state(self):
+        state = CameraSimulation.get_trace_state(self);
+        state.update({'view_data': self.view_data,
+                      'potential_locations': np.array(self.potential_locations, dtype=float).reshape(-1, 2),
+                      'observation_offset': getattr(self, 'observation_offset', None)});
+        if isinstance(self.location_encoding_model, TiledModel):
+            state.update(('model.' + name, value) for name, value in self.location_encoding_model.get_state().items());
+        return state;
+        
+    def set_trace_state(self, state):
+        CameraSimulation.set_trace_state(self, state);
+        self.view_data = state['view_data'].item();
+        self.potential_groups = [];
+        self.potential_locations = map(tuple, state['potential_locations'].tolist());
+        if state['observation_offset'] is not None:
+            self.observation_offset = tuple(state['observation_offset'].tolist());
+        if isinstance(self.location_encoding_model, TiledModel):
+            self.location_encoding_model.set_state(dict((name[len('model.'):], value) for name, value in state.items()
+                                                        if name.startswith('model.')));
+        
     def get_instructions(self):
         instructions = CameraSimulation.get_instructions(self);
         return instructions + [['Toggle view data - V']];
     
     def get_status(self):
         status = CameraSimulation.get_status(self);
-        return status + [['Observation offset: ' + str(map(int, self.observation_offset) if len(self.potential_locations) else [0, 0]),
-                          'Matching locations: ' + str(len(self.potential_locations) or '--')]];
+        status = status + [['Observation offset: ' + str(map(int, self.observation_offset) if len(self.potential_locations) else [0, 0]),
+                            'Matching locations: ' + str(len(self.potential_locations) or '--')]];
+        if self.location_encoding_model.patch_index is not None:
+            stats = self.location_encoding_model.patch_index.get_stats();
+            status[-1].append('Patch index: ' + str(stats['shapes']) + ' shapes, '
+                              + str(np.round(stats['bytes'] / 1e6, 1)) + 'MB, '
+                              + str(int(stats['build_time'] * 1000)) + 'ms, '
+                              + str(stats['hits']) + '/' + str(stats['hits'] + stats['misses']) + ' hits');
+        if self.match_cache is not None:
+            stats = self.match_cache.get_stats();
+            lookups = stats['hits'] + stats['misses'];
+            status[-1].append('Match cache: ' + str(stats['hits']) + '/' + str(lookups) + ' hits'
+                              + (' (' + str(int(100.0 * stats['hits'] / lookups)) + '%)' if lookups else '') + ', '
+                              + str(stats['entries']) + ' entries, '
+                              + str(np.round(stats['bytes'] / 1e6, 1)) + 'MB'
+                              + (', ' + str(stats['bypassed']) + ' bypassed' if stats['bypassed'] else ''));
+        if isinstance(self.location_encoding_model, TiledModel):
+            stats = self.location_encoding_model.get_stats();
+            status[-1].append('Tiles: ' + str(stats['resident']) + ' resident, '
+                              + str(np.round(stats['bytes'] / 1e6, 1)) + 'MB, '
+                              + str(stats['generated']) + ' generated, '
+                              + str(stats['evicted']) + ' evicted');
+        return status;
     
\ No newline at end of file
@@ -2,8 +2,8 @@ from simulation import Simulation
         
 class PannableSimulation(Simulation):
     
-    def __init__(self, width, height, rotation=0, title='PannableSimulation'):
-        Simulation.__init__(self, width, height, rotation, title=title);
+    def __init__(self, width, height, rotation=0, title='PannableSimulation', headless=False, retained=True):
+        Simulation.__init__(self, width, height, rotation, title=title, headless=headless, retained=retained);
         self.initial_rotation = rotation;
         
     def loop(self):
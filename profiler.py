@@ -0,0 +1,100 @@
+import time
+import json
+import collections
+import numpy as np
+
+class FrameProfiler:
+    
+    def __init__(self, window=120):
+        self.window = window;
+        self.enabled = False;
+        self.phases = [];
+        self.samples = {};
+        self.current = collections.OrderedDict();
+        self.frame = 0;
+        self.frame_start = None;
+        self.stream = None;
+        self.stream_format = None;
+    
+    def call(self, phase, function, *args):
+        if not self.enabled:
+            return function(*args);
+        start = time.time();
+        try:
+            return function(*args);
+        finally:
+            self.add(phase, time.time() - start);
+    
+    def wrap(self, phase, function):
+        def profiled(*args, **kwargs):
+            start = time.time();
+            try:
+                return function(*args, **kwargs);
+            finally:
+                self.add(phase, time.time() - start);
+        return profiled;
+    
+    def add(self, phase, seconds):
+        # A phase that runs several times in one frame is reported as its total
+        self.current[phase] = self.current.get(phase, 0.0) + seconds;
+    
+    def tick(self):
+        if not self.enabled:
+            return;
+        now = time.time();
+        if self.frame_start is not None:
+            self.current['frame'] = now - self.frame_start;
+            for phase, seconds in self.current.items():
+                if phase not in self.samples:
+                    self.samples[phase] = collections.deque(maxlen=self.window);
+                    self.phases.append(phase);
+                self.samples[phase].append(seconds);
+            if self.stream is not None:
+                self.write(self.current);
+        self.frame += 1;
+        self.frame_start = now;
+        self.current = collections.OrderedDict();
+    
+    def set_enabled(self, enabled):
+        self.enabled = enabled;
+        self.frame_start = None;
+        self.current = collections.OrderedDict();
+    
+    def reset(self):
+        self.phases = [];
+        self.samples = {};
+    
+    def get_stats(self, phase):
+        samples = np.array(self.samples.get(phase, ())) * 1000;
+        if not len(samples):
+            return None;
+        p50, p95 = np.percentile(samples, [50, 95]);
+        return p50, p95, samples.max();
+    
+    def get_status(self):
+        lines = [];
+        for phase in self.phases:
+            p50, p95, peak = self.get_stats(phase);
+            lines.append('%s: %.1f / %.1f / %.1f ms' % (phase, p50, p95, peak));
+        return ['Profile p50 / p95 / max (' + str(len(self.samples.get('frame', ()))) + ' frames)'] + lines;
+    
+    def open_stream(self, path):
+        self.close_stream();
+        self.stream_format = 'csv' if path.endswith('.csv') else 'jsonl';
+        self.stream = open(path, 'w');
+        if self.stream_format == 'csv':
+            self.stream.write('frame,timestamp,phase,ms\n');
+    
+    def close_stream(self):
+        if self.stream is not None:
+            self.stream.close();
+            self.stream = None;
+    
+    def write(self, timings):
+        timestamp = self.frame_start;
+        if self.stream_format == 'csv':
+            for phase, seconds in timings.items():
+                self.stream.write('%d,%.6f,%s,%.4f\n' % (self.frame, timestamp, phase, seconds * 1000));
+        else:
+            self.stream.write(json.dumps({'frame': self.frame, 'timestamp': timestamp,
+                                          'ms': collections.OrderedDict((phase, seconds * 1000) for phase, seconds in timings.items())}) + '\n');
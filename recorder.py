@@ -0,0 +1,228 @@
+import time
+import Queue
+import atexit
+import threading
+import collections
+import numpy as np
+import cv2
+
+# BGR values for the Tk color names the simulations use
+COLORS = {'white': (255, 255, 255),
+          'black': (0, 0, 0),
+          'gray': (190, 190, 190),
+          'grey': (190, 190, 190),
+          'red': (0, 0, 255),
+          'green': (0, 128, 0),
+          'blue': (255, 0, 0)};
+
+DEFAULTS = {'polygon': {'fill': 'black', 'outline': '', 'width': 1},
+            'oval': {'fill': '', 'outline': 'black', 'width': 1},
+            'text': {'fill': 'black', 'anchor': 'center', 'font': 'TkDefaultFont', 'text': ''},
+            'image': {'anchor': 'center', 'image': ''}};
+
+TEXT_HEIGHT = 34.0;
+SUBPIXEL_BITS = 4;
+
+def parse_color(color):
+    if not color:
+        return None;
+    color = str(color);
+    if color.startswith('#'):
+        digits = color[1:];
+        size = len(digits) / 3;
+        # Tk scales short forms like #F99 by repeating each digit
+        return tuple(int(digits[i * size:(i + 1) * size] * (2 if size == 1 else 1), 16) for i in (2, 1, 0));
+    return COLORS.get(color.lower(), (0, 0, 0));
+
+def parse_font_size(font):
+    if isinstance(font, (tuple, list)):
+        parts = font;
+    else:
+        parts = str(font).replace('{', ' ').replace('}', ' ').split();
+    for part in parts:
+        try:
+            return abs(int(part));
+        except (TypeError, ValueError):
+            pass;
+    return 10;
+
+class OffscreenImage:
+    
+    def __init__(self, rgba):
+        self.rgba = rgba;
+
+class OffscreenCanvas:
+    
+    def __init__(self, width, height, background='gray'):
+        self.width = int(width);
+        self.height = int(height);
+        self.background = background;
+        self.items = collections.OrderedDict();
+        self.next_id = 1;
+    
+    def create(self, kind, coords, options):
+        item_id = self.next_id;
+        self.next_id += 1;
+        tags = options.pop('tags', ());
+        self.items[item_id] = [kind, [float(c) for c in coords], options, set(tags)];
+        return item_id;
+    
+    def create_polygon(self, *coords, **options):
+        return self.create('polygon', coords, options);
+    
+    def create_oval(self, *coords, **options):
+        return self.create('oval', coords, options);
+    
+    def create_text(self, *coords, **options):
+        return self.create('text', coords, options);
+    
+    def create_image(self, *coords, **options):
+        return self.create('image', coords, options);
+    
+    def find(self, tag_or_id):
+        if tag_or_id == 'all':
+            return list(self.items);
+        if tag_or_id in self.items:
+            return [tag_or_id];
+        return [item_id for item_id, item in self.items.items() if tag_or_id in item[3]];
+    
+    def find_all(self):
+        return list(self.items);
+    
+    def type(self, item_id):
+        return self.items[item_id][0];
+    
+    def coords(self, item_id, *coords):
+        if not coords:
+            return list(self.items[item_id][1]);
+        self.items[item_id][1] = [float(c) for c in coords];
+    
+    def itemconfig(self, item_id, **options):
+        self.items[item_id][2].update(options);
+    
+    def itemcget(self, item_id, option):
+        kind, _, options, _ = self.items[item_id];
+        return options.get(option, DEFAULTS[kind].get(option, ''));
+    
+    def delete(self, tag_or_id):
+        for item_id in self.find(tag_or_id):
+            del self.items[item_id];
+    
+    def move(self, tag_or_id, dx, dy):
+        for item_id in self.find(tag_or_id):
+            coords = self.items[item_id][1];
+            coords[0::2] = [x + dx for x in coords[0::2]];
+            coords[1::2] = [y + dy for y in coords[1::2]];
+    
+    def tag_raise(self, tag_or_id):
+        for item_id in self.find(tag_or_id):
+            self.items[item_id] = self.items.pop(item_id);
+    
+    def rasterize(self, images=None):
+        return rasterize(self, self.width, self.height, self.background, images);
+
+def rasterize(canvas, width, height, background='gray', images=None):
+    # Reads the scene back through the Tk canvas API, so a real Canvas and an OffscreenCanvas draw the same
+    frame = np.empty((int(height), int(width), 3), dtype=np.uint8);
+    frame[:] = parse_color(background);
+    scale = 1 << SUBPIXEL_BITS;
+    for item_id in canvas.find_all():
+        kind = canvas.type(item_id);
+        coords = np.asarray(canvas.coords(item_id), dtype=float);
+        if kind == 'polygon':
+            points = np.round(coords.reshape(-1, 2) * scale).astype(np.int32);
+            fill = parse_color(canvas.itemcget(item_id, 'fill'));
+            outline = parse_color(canvas.itemcget(item_id, 'outline'));
+            if fill is not None and len(points) > 2:
+                cv2.fillPoly(frame, [points], fill, cv2.LINE_AA, SUBPIXEL_BITS);
+            if outline is not None:
+                thickness = max(1, int(round(float(canvas.itemcget(item_id, 'width') or 1))));
+                cv2.polylines(frame, [points], len(points) > 2, outline, thickness, cv2.LINE_AA, SUBPIXEL_BITS);
+        elif kind == 'oval':
+            x0, y0, x1, y1 = coords;
+            center = (int(round((x0 + x1) / 2 * scale)), int(round((y0 + y1) / 2 * scale)));
+            axes = (int(round(abs(x1 - x0) / 2 * scale)), int(round(abs(y1 - y0) / 2 * scale)));
+            fill = parse_color(canvas.itemcget(item_id, 'fill'));
+            outline = parse_color(canvas.itemcget(item_id, 'outline'));
+            if fill is not None:
+                cv2.ellipse(frame, center, axes, 0, 0, 360, fill, -1, cv2.LINE_AA, SUBPIXEL_BITS);
+            if outline is not None:
+                cv2.ellipse(frame, center, axes, 0, 0, 360, outline, 1, cv2.LINE_AA, SUBPIXEL_BITS);
+        elif kind == 'text':
+            text = str(canvas.itemcget(item_id, 'text'));
+            font_scale = parse_font_size(canvas.itemcget(item_id, 'font')) / TEXT_HEIGHT;
+            (text_width, text_height), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, 1);
+            anchor = str(canvas.itemcget(item_id, 'anchor'));
+            x = coords[0] - (0 if 'w' in anchor else text_width if 'e' in anchor else text_width / 2.0);
+            y = coords[1] + (text_height if anchor.startswith('n') else 0 if anchor.startswith('s') else text_height / 2.0);
+            cv2.putText(frame, text, (int(round(x)), int(round(y))), cv2.FONT_HERSHEY_SIMPLEX, font_scale,
+                        parse_color(canvas.itemcget(item_id, 'fill')) or (0, 0, 0), 1, cv2.LINE_AA);
+        elif kind == 'image':
+            image = canvas.itemcget(item_id, 'image');
+            rgba = getattr(image, 'rgba', None);
+            if rgba is None and images is not None:
+                rgba = images.get(str(image));
+            if rgba is not None:
+                blend(frame, rgba, coords[0], coords[1], str(canvas.itemcget(item_id, 'anchor')));
+    return frame;
+
+def blend(frame, rgba, x, y, anchor):
+    height, width = rgba.shape[:2];
+    x = int(round(x - (0 if 'w' in anchor else width if 'e' in anchor else width / 2.0)));
+    y = int(round(y - (0 if anchor.startswith('n') else height if anchor.startswith('s') else height / 2.0)));
+    x0, y0 = max(0, x), max(0, y);
+    x1, y1 = min(frame.shape[1], x + width), min(frame.shape[0], y + height);
+    if x0 >= x1 or y0 >= y1:
+        return;
+    source = rgba[y0 - y:y1 - y, x0 - x:x1 - x];
+    alpha = source[:, :, 3:4].astype(np.float32) / 255;
+    target = frame[y0:y1, x0:x1];
+    target[:] = target * (1 - alpha) + source[:, :, 2::-1] * alpha;
+
+class VideoRecorder(threading.Thread):
+    
+    def __init__(self, path, fps, size, max_queue=32):
+        threading.Thread.__init__(self);
+        self.daemon = True;
+        self.path = path;
+        self.fps = fps;
+        self.size = (int(size[0]), int(size[1]));
+        self.queue = Queue.Queue(max_queue);
+        self.frames = 0;
+        self.written = 0;
+        self.stalls = 0;
+        self.encode_time = 0.0;
+        self.closed = False;
+        atexit.register(self.close);
+    
+    def submit(self, frame):
+        # Blocks when the writer falls behind, so the video never drops simulated frames
+        if self.queue.full():
+            self.stalls += 1;
+        self.queue.put(frame);
+        self.frames += 1;
+    
+    def close(self):
+        if self.closed:
+            return;
+        self.closed = True;
+        self.queue.put(None);
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join();
+    
+    def run(self):
+        video = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*'mp4v'), self.fps, self.size, True);
+        while True:
+            frame = self.queue.get();
+            if frame is None:
+                break;
+            start = time.time();
+            if (frame.shape[1], frame.shape[0]) != self.size:
+                frame = cv2.resize(frame, self.size);
+            video.write(frame);
+            self.encode_time += time.time() - start;
+            self.written += 1;
+        video.release();
+    
+    def get_pending(self):
+        return self.queue.qsize();
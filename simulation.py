@@ -1,86 +1,147 @@
-from Tkinter import *
+try:
+    from Tkinter import *
+except ImportError:
+    Tk = None;
+import sys
 import math
 import numpy as np
-import itertools
 import cv2
-from pyscreenshot import grab
+try:
+    from pyscreenshot import grab
+except ImportError:
+    grab = None;
 import time
+import base64
+import collections
+
+from canvas_pool import CanvasItemPool
+from recorder import OffscreenCanvas, OffscreenImage, VideoRecorder, rasterize
+from profiler import FrameProfiler
+from tracing import TraceWriter
+
+class KeyEvent:
+    
+    def __init__(self, keysym):
+        self.keysym = keysym;
 
 class Simulation:
     
     MAX_CANVAS_WIDTH = 1200;
     MAX_CANVAS_HEIGHT = 800;
     ZOOM_FACTOR = 21.0 / 20;
-    TARGET_FPS = 20;
+    TICK_RATE = 20;
+    TARGET_FPS = 30;
+    MAX_CATCH_UP_TICKS = 10;
     
-    def __init__(self, width, height, rotation=0, title='Simulation'):
+    def __init__(self, width, height, rotation=0, title='Simulation', headless=False, retained=True):
         self.width = width;
         self.height = height;
         self.rotation = rotation;
+        self.headless = headless;
+        self.retained = retained;
         self.init_canvas();
-        self.root.title(title);
+        if not self.headless:
+            self.root.title(title);
         self.zoom = 0;
         self.pressed_set = set();
-        self.timestamp_memory = 10;
-        self.timestamps = [time.time()] * self.timestamp_memory;
-        self.fps = Simulation.TARGET_FPS;
-        self.max_render_skips = 5;
+        self.tick_interval = 1.0 / Simulation.TICK_RATE;
+        self.render_interval = 1.0 / Simulation.TARGET_FPS;
+        self.next_tick = None;
+        self.next_render = 0.0;
+        self.tick_times = collections.deque(maxlen=Simulation.TICK_RATE);
+        self.render_times = collections.deque(maxlen=Simulation.TARGET_FPS);
+        self.rendered_count = 0;
+        self.dropped_frames = 0;
+        self.dropped_ticks = 0;
         self.count = 0;
-        self.render_skips = 1;
-        self.video = None;
+        self.view_matrix = None;
+        self.view_matrix_key = None;
+        self.static_layers = {};
+        self.images = [];
+        self.image_sources = {};
+        self.recorder = None;
         self.recording = False;
-        self.recording_start = 0.0;
-        self.recording_stop = 0.0;
+        self.recording_tick = None;
+        self.profiler = FrameProfiler();
+        self.random = np.random.RandomState();
+        self.tracer = None;
         
         scale = self.scale * Simulation.ZOOM_FACTOR ** self.zoom;
         self.canvas_balance_offset = ((self.canvas_width - 1) / 2 * (1 - scale) / scale,
                                       (self.canvas_height - 1) / 2 * (1 - scale) / scale);
         self._canvas_pos = tuple(self.canvas_balance_offset);
         
-        self.root.after(0, self._loop);
+        if not self.headless:
+            self.root.after(0, self._loop);
         
     def _loop(self):
-        if self.count % 4 == 0:
-            self.render_skips = min(int(max(1, Simulation.TARGET_FPS / self.fps)), self.max_render_skips);
-        decrement_attempt = self.count % 16 == 0;
-        if decrement_attempt:
-            self.render_skips = max(1, self.render_skips - 1);
-        if self.count % self.render_skips == 0 or self.recording or decrement_attempt:
-            timestamp = time.time();
-            self.fps = 1.0/(timestamp - self.timestamps.pop(0)) * self.timestamp_memory;
-            self.timestamps.append(timestamp);
-        self.count += 1;
+        # Simulation ticks advance on a fixed timestep; rendering only uses the time left over
+        now = time.time();
+        if self.next_tick is None:
+            self.next_tick = now;
+        ticks = 0;
+        while self.next_tick <= now and ticks < Simulation.MAX_CATCH_UP_TICKS:
+            self.step();
+            self.next_tick += self.tick_interval;
+            ticks += 1;
+        if self.next_tick <= now:
+            # Too far behind to catch up, so slow the simulation down instead of spiralling
+            self.dropped_ticks += int((now - self.next_tick) / self.tick_interval) + 1;
+            self.next_tick = now + self.tick_interval;
         
-        self.fire_key_events();
-        self.loop();
+        now = time.time();
+        if not self.recording and self.count != self.rendered_count and now >= self.next_render:
+            self.render_frame();
+            self.next_render = max(self.next_render + self.render_interval, now);
         
-        if self.count % self.render_skips == 0 or self.recording:
-            self.clear();
-            self.pre_render();
-            self.render();
-            self.done_rendering();
-            
-        self.root.after(1, self._loop);
+        delay = min(self.next_tick, self.next_render if self.count != self.rendered_count else self.next_tick) - time.time();
+        self.root.after(max(1, int(delay * 1000)), self._loop);
+        
+    def step(self, keysyms=None):
+        if keysyms is not None:
+            self.pressed_set = set(keysyms);
+        self.profiler.tick();
+        self.count += 1;
+        self.tick_times.append(time.time());
+        if self.tracer is not None:
+            self.tracer.tick(self.pressed_set);
+        self.profiler.call('fire_key_events', self.fire_key_events);
+        self.profiler.call('loop', self.loop);
+        if self.tracer is not None:
+            self.tracer.observe(self);
+        if self.recording:
+            # Every tick becomes a video frame, so recordings play back at TICK_RATE
+            self.render_frame();
+        
+    def run(self, steps, keysyms=None):
+        for _ in range(steps):
+            self.step(keysyms);
         
     def loop(self):
         pass;
         
     def init_canvas(self):
-        corners = map(lambda x: self.rotate_transform(x[0], x[1]), 
-                      [(0, 0),
-                       (self.width, 0),
-                       (self.width, self.height),
-                       (0, self.height)]);
-        xs = map(lambda x: x[0], corners);
-        ys = map(lambda x: x[1], corners);
+        corners = self.rotate_points([(0, 0),
+                                      (self.width, 0),
+                                      (self.width, self.height),
+                                      (0, self.height)]);
+        xs = corners[:, 0];
+        ys = corners[:, 1];
         min_margin = 0.15;
         #self.adjusted_width = max(max(xs) - min(xs), (1 + min_margin) * self.width);
         #self.adjusted_height = max(max(ys) - min(ys), (1 + min_margin) * self.height);
-        margin = max(max(xs) - min(xs), max(ys) - min(ys)) * min_margin;
-        self.adjusted_width = max(xs) - min(xs) + margin;
-        self.adjusted_height = max(ys) - min(ys) + margin;
+        margin = max(xs.max() - xs.min(), ys.max() - ys.min()) * min_margin;
+        self.adjusted_width = xs.max() - xs.min() + margin;
+        self.adjusted_height = ys.max() - ys.min() + margin;
         
         self.init_scale();
+        if self.headless:
+            self.root = None;
+            self.canvas = None;
+            self.canvas_pool = None;
+            return;
+        if Tk is None:
+            raise RuntimeError('Tkinter is unavailable, use headless=True');
         self.root = Tk();
         self.root.bind("<KeyPress>", self.key_down)
         self.root.bind("<KeyRelease>", self.key_up)
@@ -89,6 +150,7 @@ class Simulation:
                              height=self.canvas_height,
                              background='gray');
         self.canvas.pack();
+        self.canvas_pool = CanvasItemPool(self.canvas) if self.retained else None;
         
     def init_scale(self):
         desired_width = Simulation.MAX_CANVAS_WIDTH;
@@ -100,13 +162,31 @@ class Simulation:
         self.x_offset = self.scale * float(self.adjusted_width - self.width) / 2 + 3;
         self.y_offset = self.scale * float(self.adjusted_height - self.height) / 2 + 3;
                             
+    def render_frame(self):
+        self.dropped_frames += max(0, self.count - self.rendered_count - 1);
+        self.rendered_count = self.count;
+        self.render_times.append(time.time());
+        self.profiler.call('clear', self.clear);
+        self.profiler.call('pre_render', self.pre_render);
+        self.profiler.call('render', self.render);
+        self.profiler.call('done_rendering', self.done_rendering);
+        if self.root is not None:
+            self.profiler.call('root.update', self.root.update);
+        
     def clear(self):
-        self.canvas.delete('all');
+        self.images = [];
+        self.image_sources = {};
+        if self.canvas_pool is None:
+            self.canvas.delete('all');
+        else:
+            self.canvas_pool.begin_frame();
         
     def pre_render(self):
         # Render border
+        self.set_layer('background');
         self.draw_polygon((0, 0), (self.width, 0), (self.width, self.height), (0, self.height), fill='white');
-        self.canvas.create_text(10, 15, text='Controls:', anchor='w', font=(None, 16));
+        self.set_layer('hud');
+        self.draw_text(10, 15, text='Controls:', anchor='w', font=(None, 16));
         instructions = self.get_instructions();
         statuses = self.get_status();
         col = 0;
@@ -122,7 +202,7 @@ class Simulation:
                     max_width = 0;
                     col += 1;
                 max_width = max(max_width, len(instruction_set[i]));
-                self.canvas.create_text(offset, 15 + 10 * (i % lines_per_group), text=instruction_set[i], anchor='w', font=('monaco', 10));
+                self.draw_text(offset, 15 + 10 * (i % lines_per_group), text=instruction_set[i], anchor='w', font=('monaco', 10));
             offset += kerning * max_width + col_spacing;
             col += 1;
             
@@ -135,7 +215,7 @@ class Simulation:
                     max_width = 0;
                     col += 1;
                 max_width = max(max_width, len(status_set[i]));
-                self.canvas.create_text(offset, self.canvas_height - 10 - 10 * (i % lines_per_group), text=status_set[i], anchor='w', font=('monaco', 10));
+                self.draw_text(offset, self.canvas_height - 10 - 10 * (i % lines_per_group), text=status_set[i], anchor='w', font=('monaco', 10));
             offset += kerning * max_width + col_spacing;
             col += 1;
             
@@ -143,44 +223,144 @@ class Simulation:
         pass
         
     def done_rendering(self):
+        self.set_layer('foreground');
         self.draw_polygon((0, 0), (self.width, 0), (self.width, self.height), (0, self.height));
-        self.root.update();
-        if self.recording:
-            self.recording_stop = time.time();
-            print 'RECORDING ' + str(np.round(self.recording_stop - self.recording_start, 1)) + 's';
-            bbox = self.get_bbox();
-            img = grab(bbox);
-            img = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR);
-            if self.video is None:
-                height, width, _ = np.shape(img);
-                self.video = cv2.VideoWriter('video' + str(int(time.time())) + '.mp4', -1, 20, (width, height), True);
-            self.video.write(img);
+        if self.canvas_pool is not None:
+            self.canvas_pool.end_frame();
+        if self.recording and self.recording_tick != self.count:
+            self.recording_tick = self.count;
+            self.recorder.submit(rasterize(self.canvas, self.canvas_width, self.canvas_height, images=self.image_sources));
     
     def draw_line(self, x1, y1, x2, y2, **kwargs):
         self.draw_polygon((x1, y1), (x2, y2), **kwargs);
     
+    def draw_lines(self, starts, ends, **kwargs):
+        kwargs['fill'] = kwargs.get('fill', '');
+        kwargs['outline'] = kwargs.get('outline', 'black');
+        keys = kwargs.pop('keys', None);
+        points = np.hstack((self.transform_points(starts), self.transform_points(ends)));
+        for index, coords in enumerate(points.tolist()):
+            self.create_item('polygon', coords, kwargs, None if keys is None else keys[index]);
+    
     def draw_polygon(self, *points, **kwargs):
         kwargs['fill'] = kwargs.get('fill', '');
         kwargs['outline'] = kwargs.get('outline', 'black');
-        points = map(lambda p: self.transform(p[0], p[1]), points);
-        points = list(itertools.chain(*points));
-        self.canvas.create_polygon(*points, **kwargs);
+        key = kwargs.pop('key', None);
+        if len(points) == 1 and np.ndim(points[0]) == 2:
+            points = points[0];
+        self.create_item('polygon', self.transform_points(points).ravel().tolist(), kwargs, key);
     
     def draw_circle(self, x, y, radius=1, transformed=True, **kwargs):
-        x, y = self.transform(x, y);
-        radius *= self.scale * Simulation.ZOOM_FACTOR ** self.zoom;
-        self.canvas.create_oval(x - radius, y - radius, x + radius, y + radius, **kwargs);
+        self.draw_circles([(x, y)], [radius], **kwargs);
         
-    def transform(self, x, y):
-        x, y = self.rotate_and_scale(x, y);
+    def draw_circles(self, positions, radii, **kwargs):
+        centers = self.transform_points(positions);
+        radii = np.broadcast_to(np.asarray(radii, dtype=float) * self.get_view_scale(), (len(centers),));
+        bounds = np.column_stack((centers - radii[:, np.newaxis], centers + radii[:, np.newaxis]));
+        for coords in bounds.tolist():
+            self.create_item('oval', coords, kwargs);
         
-        scaled_x_offset = self.x_offset * Simulation.ZOOM_FACTOR ** self.zoom;
-        scaled_y_offset = self.y_offset * Simulation.ZOOM_FACTOR ** self.zoom;
+    def draw_text(self, x, y, **kwargs):
+        key = kwargs.pop('key', None);
+        self.create_item('text', (x, y), kwargs, key);
         
-        x -= self._canvas_pos[0];
-        y -= self._canvas_pos[1];
-            
-        return x + scaled_x_offset, y + scaled_y_offset;
+    def draw_image(self, x, y, rgba, **kwargs):
+        # Tk 8.6 decodes PNG with alpha, so the image only covers its opaque pixels
+        if self.root is None:
+            image = OffscreenImage(rgba);
+        else:
+            _, png = cv2.imencode('.png', cv2.cvtColor(rgba, cv2.COLOR_RGBA2BGRA));
+            image = PhotoImage(data=base64.b64encode(png.tostring()));
+            self.image_sources[str(image)] = rgba;
+        kwargs['anchor'] = kwargs.get('anchor', 'nw');
+        kwargs['image'] = image;
+        self.images.append(image);
+        self.create_item('image', (x, y), kwargs);
+        
+    def create_item(self, kind, coords, options, key=None):
+        if self.canvas_pool is None:
+            return getattr(self.canvas, 'create_' + kind)(*coords, **options);
+        if key is not None:
+            return self.canvas_pool.draw_keyed(key, kind, coords, options);
+        return self.canvas_pool.draw(kind, coords, options);
+    
+    def set_layer(self, name):
+        if self.canvas_pool is not None:
+            self.canvas_pool.set_layer(name);
+    
+    def begin_static_layer(self, name, key):
+        # 'keep' leaves last frame's items alone, 'pan' has shifted them with the view so only newly exposed
+        # keys need drawing, and 'redraw' means every item has to be drawn again
+        self.set_layer(name);
+        if self.canvas_pool is None:
+            return 'redraw';
+        matrix = self.get_view_matrix();
+        previous = self.static_layers.get(name);
+        self.static_layers[name] = (key, matrix, self.canvas_pool.frame);
+        if (previous is None or previous[0] != key or previous[2] != self.canvas_pool.frame - 1
+                or not np.array_equal(previous[1][:2, :2], matrix[:2, :2])):
+            return 'redraw';
+        dx, dy = matrix[:2, 2] - previous[1][:2, 2];
+        if dx == 0 and dy == 0:
+            self.canvas_pool.keep_layer(name);
+            return 'keep';
+        self.canvas_pool.move_layer(name, dx, dy);
+        return 'pan';
+    
+    def get_static_mask(self, mode, keys):
+        if mode != 'pan':
+            return np.ones(len(keys), dtype=bool);
+        missing = set(self.canvas_pool.touch_keyed(keys));
+        return np.array([key in missing for key in keys], dtype=bool).reshape(-1);
+        
+    def transform(self, x, y):
+        matrix = self.get_view_matrix();
+        return (matrix[0, 0] * x + matrix[0, 1] * y + matrix[0, 2],
+                matrix[1, 0] * x + matrix[1, 1] * y + matrix[1, 2]);
+    
+    def transform_points(self, points):
+        matrix = self.get_view_matrix();
+        points = np.asarray(points, dtype=float).reshape(-1, 2);
+        return np.dot(points, matrix[:2, :2].T) + matrix[:2, 2];
+    
+    def get_view_scale(self):
+        return self.scale * Simulation.ZOOM_FACTOR ** self.zoom;
+    
+    def get_view_bounds(self):
+        inverse = np.linalg.inv(self.get_view_matrix());
+        corners = np.array([(0, 0), (self.canvas_width, 0), (self.canvas_width, self.canvas_height), (0, self.canvas_height)], dtype=float);
+        points = np.dot(corners, inverse[:2, :2].T) + inverse[:2, 2];
+        return tuple(points.min(axis=0)) + tuple(points.max(axis=0));
+    
+    def get_view_matrix(self):
+        key = (self.rotation, self.zoom, self._canvas_pos);
+        if key != self.view_matrix_key:
+            self.view_matrix = self.build_view_matrix();
+            self.view_matrix_key = key;
+        return self.view_matrix;
+    
+    def build_view_matrix(self):
+        def translation(x, y):
+            return np.array([[1, 0, x], [0, 1, y], [0, 0, 1]], dtype=float);
+        rads = math.radians(self.rotation);
+        rotation = np.array([[math.cos(rads), -math.sin(rads), 0], [math.sin(rads), math.cos(rads), 0], [0, 0, 1]]);
+        scale = self.get_view_scale();
+        about = (self._canvas_pos[0] + self.canvas_width / 2, self._canvas_pos[1] + self.canvas_height / 2);
+        zoom = Simulation.ZOOM_FACTOR ** self.zoom;
+        return reduce(np.dot, [translation(self.x_offset * zoom - self._canvas_pos[0], self.y_offset * zoom - self._canvas_pos[1]),
+                               translation(*about), np.diag([scale, scale, 1]), translation(-about[0], -about[1]),
+                               translation(self.width / 2.0, self.height / 2.0), rotation,
+                               translation(-self.width / 2.0, -self.height / 2.0)]);
+    
+    def rotate_points(self, points, rotation=None, about=None):
+        if rotation is None:
+            rotation = self.rotation;
+        if about is None:
+            about = (self.width / 2.0, self.height / 2.0);
+        points = np.asarray(points, dtype=float).reshape(-1, 2) - about;
+        rads = math.radians(rotation);
+        cos, sin = math.cos(rads), math.sin(rads);
+        return np.column_stack((points[:, 0] * cos - points[:, 1] * sin, points[:, 0] * sin + points[:, 1] * cos)) + about;
     
     def rotate_and_scale(self, x, y):
         x, y = self.rotate_transform(x, y);
@@ -216,10 +396,16 @@ class Simulation:
         return self._canvas_pos[0] - self.canvas_balance_offset[0], self._canvas_pos[1] - self.canvas_balance_offset[1];
     
     def key_down(self, event):
+        if self.tracer is not None:
+            self.tracer.key_down(event.keysym);
         self.pressed_set.add(event.keysym);
         # Immediate response
         if event.keysym == 'Escape' or event.keysym == 'Return':
             sys.exit();
+        if event.keysym == 'f':
+            self.set_profiling(not self.profiler.enabled);
+        if self.headless:
+            return;
         if event.keysym == 'p':
             self.screenshot();
         if event.keysym == 'l':
@@ -227,9 +413,20 @@ class Simulation:
                 self.stop_recording();
             else:
                 self.start_recording();
+        if event.keysym == 'z':
+            if self.tracer is not None:
+                self.stop_tracing();
+            else:
+                self.start_tracing();
         
     def key_up(self, event):
         self.pressed_set.remove(event.keysym);
+        
+    def press(self, keysym):
+        self.key_down(KeyEvent(keysym));
+        
+    def release(self, keysym):
+        self.key_up(KeyEvent(keysym));
     
     def fire_key_events(self):
         self.key_event(self.pressed_set);
@@ -247,25 +444,92 @@ class Simulation:
     def get_bbox(self):
         return self.root.winfo_x(), self.root.winfo_y() + 22, self.canvas_width + 6, self.canvas_height + 6;
         
-    def start_recording(self):
+    def init_offscreen_canvas(self):
+        self.canvas = OffscreenCanvas(self.canvas_width, self.canvas_height);
+        self.canvas_pool = CanvasItemPool(self.canvas) if self.retained else None;
+        self.static_layers = {};
+        
+    def start_recording(self, path=None, max_queue=32):
+        if path is None:
+            path = 'video' + str(int(time.time())) + '.mp4';
+        if self.canvas is None:
+            self.init_offscreen_canvas();
+        self.recorder = VideoRecorder(path, Simulation.TICK_RATE, (self.canvas_width, self.canvas_height), max_queue);
+        self.recorder.start();
         self.recording = True;
-        self.recording_start = time.time();
+        self.recording_tick = None;
         
     def stop_recording(self):
         self.recording = False;
-        self.video.release();
-        self.video = None;
+        self.recorder.close();
+        print 'Recorded ' + str(self.recorder.written) + ' frames to ' + self.recorder.path;
+        if self.headless:
+            self.canvas = None;
+            self.canvas_pool = None;
+            
+    def start_tracing(self, path=None, options=None, visible=True, particles=False, particle_interval=10, seed=None):
+        # options are the constructor keyword arguments a replay should pass; everything the run changed
+        # since construction is captured by get_trace_state
+        if path is None:
+            path = 'trace' + str(int(time.time())) + '.trace';
+        self.tracer = TraceWriter(path, self, options, visible, particles, particle_interval, seed);
+        
+    def stop_tracing(self):
+        tracer = self.tracer;
+        self.tracer = None;
+        tracer.close();
+        print 'Traced ' + str(tracer.ticks) + ' ticks to ' + tracer.path;
+        
+    def seed_random(self, seed):
+        self.random.seed(seed);
+        
+    def get_trace_state(self):
+        return {'rotation': self.rotation,
+                'zoom': self.zoom,
+                'canvas_pos': self._canvas_pos};
+        
+    def set_trace_state(self, state):
+        self.rotation = state['rotation'].item();
+        self.zoom = state['zoom'].item();
+        self._canvas_pos = tuple(state['canvas_pos']);
+        
+    def get_trace_observation(self, particles):
+        return {};
+        
+    def set_profiling(self, enabled):
+        self.profiler.set_enabled(enabled);
+        # Hooks are only wrapped while profiling so the disabled path stays a plain method call
+        for name in self.get_profiled_hooks():
+            if enabled:
+                setattr(self, name, self.profiler.wrap(name, getattr(self, name)));
+            elif name in self.__dict__:
+                delattr(self, name);
+        
+    def get_profiled_hooks(self):
+        return [];
             
     def get_instructions(self):
         return [['Exit - Esc', 
-                 'Screenshot - P']];
+                 'Screenshot - P',
+                 'Toggle trace - Z',
+                 'Toggle profiler - F']];
+            
+    def get_rate(self, times):
+        if len(times) < 2 or times[-1] == times[0]:
+            return 0.0;
+        return (len(times) - 1) / (times[-1] - times[0]);
             
     def get_status(self):
         return [['Canvas size: ' + str(int(self.canvas_width)) + ' x ' + str(int(self.canvas_height)),
                  'World size: ' + str(int(self.width)) + ' x ' + str(int(self.height)),
-                 'FPS: ' + str(int(self.fps * 10) / 10.0,) + ' (\\' + str(1 if self.recording else self.render_skips) + ')'],
+                 'Sim rate: ' + str(round(self.get_rate(self.tick_times), 1)) + ' / ' + str(Simulation.TICK_RATE) + ' Hz (' + str(self.dropped_ticks) + ' dropped)',
+                 'FPS: ' + str(round(self.get_rate(self.render_times), 1)) + ' / ' + str(Simulation.TARGET_FPS) + ' (' + str(self.dropped_frames) + ' ticks unrendered)'],
                 ['Rotation: ' + str(self.rotation),
                  'Zoom: ' + str(self.zoom),
                  'Scale: ' + str(self.scale * Simulation.ZOOM_FACTOR ** self.zoom),
-                 'Canvas pos: ' + str(map(int, self.get_canvas_pos()))]];
+                 'Canvas pos: ' + str(map(int, self.get_canvas_pos()))]] + ([] if not self.recording else
+               [['Recording: ' + str(self.recorder.frames) + ' frames (' + str(self.recorder.frames / Simulation.TICK_RATE) + 's)',
+                 'Encoder queue: ' + str(self.recorder.get_pending()) + ' (' + str(self.recorder.stalls) + ' stalls)']]) + ([] if self.tracer is None else
+               [['Tracing: ' + str(self.tracer.ticks) + ' ticks (' + str(self.tracer.get_size() / 1024) + 'KB)']]) + ([] if not self.profiler.enabled else
+               [self.profiler.get_status()]);
         
\ No newline at end of file
@@ -0,0 +1,58 @@
+import numpy as np
+
+def concatenate_ranges(starts, ends):
+    # np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)]) without the Python loop
+    lengths = ends - starts;
+    total = lengths.sum();
+    if not total:
+        return np.zeros(0, dtype=np.int64);
+    return np.arange(total) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths);
+
+class GridIndex:
+    
+    # Points bucketed into a uniform grid of square buckets and stored CSR style: point indices ordered by bucket
+    # key, the occupied keys, and where each key's run starts. A rectangle query visits only the buckets it
+    # overlaps, so its cost follows the number of points near the rectangle rather than the total.
+    def __init__(self, bucket_size, points=None):
+        self.bucket_size = float(bucket_size);
+        self.build(np.zeros((0, 2)) if points is None else points);
+    
+    def build(self, points):
+        points = np.asarray(points, dtype=float).reshape(-1, 2);
+        self.size = len(points);
+        if not self.size:
+            self.low = self.high = np.zeros(2, dtype=np.int64);
+            self.rows = 1;
+            self.order = self.keys = np.zeros(0, dtype=np.int64);
+            self.starts = np.zeros(1, dtype=np.int64);
+            return;
+        buckets = np.floor(points / self.bucket_size).astype(np.int64);
+        self.low = buckets.min(axis=0);
+        self.high = buckets.max(axis=0);
+        self.rows = self.high[1] - self.low[1] + 1;
+        keys = (buckets[:, 0] - self.low[0]) * self.rows + buckets[:, 1] - self.low[1];
+        self.order = np.argsort(keys, kind='mergesort');
+        self.keys, counts = np.unique(keys[self.order], return_counts=True);
+        self.starts = np.concatenate(([0], np.cumsum(counts)));
+    
+    def query(self, low_x, low_y, high_x, high_y):
+        # Indices, ascending, of every point in a bucket overlapping the rectangle; a superset of the points
+        # inside it, which callers trim with an exact test on the few that come back
+        if not len(self.keys):
+            return np.zeros(0, dtype=np.int64);
+        low = np.clip(np.floor(np.array([low_x, low_y]) / self.bucket_size), self.low, self.high + 1).astype(np.int64) - self.low;
+        high = np.clip(np.floor(np.array([high_x, high_y]) / self.bucket_size), self.low - 1, self.high).astype(np.int64) - self.low;
+        if (high < low).any():
+            return np.zeros(0, dtype=np.int64);
+        columns = np.arange(low[0], high[0] + 1);
+        if len(columns) < len(self.keys):
+            # Each column's buckets are a contiguous run of keys
+            buckets = concatenate_ranges(np.searchsorted(self.keys, columns * self.rows + low[1]),
+                                         np.searchsorted(self.keys, columns * self.rows + high[1], side='right'));
+        else:
+            # Zoomed out past the occupied area: checking the occupied buckets directly is cheaper
+            x, y = np.divmod(self.keys, self.rows);
+            buckets = np.nonzero((x >= low[0]) & (x <= high[0]) & (y >= low[1]) & (y <= high[1]))[0];
+        if len(buckets) == len(self.keys):
+            return np.arange(self.size);
+        return np.sort(self.order[concatenate_ranges(self.starts[buckets], self.starts[buckets + 1])]);
@@ -0,0 +1,319 @@
+import io
+import os
+import sys
+import json
+import time
+import zlib
+import struct
+import argparse
+import tempfile
+import importlib
+import numpy as np
+
+from locationencodingmodel import LocationEncodingModel, TiledModel
+
+# A trace is TRACE_MAGIC followed by records, each a (type, length) RECORD header and its payload:
+#   HEADER       json: simulation class, world size, constructor options, seed, what is recorded
+#   MODEL        zlib-compressed LocationEncodingModel file, so unseeded models replay exactly (a TiledModel is
+#                rebuilt from the options in the header instead)
+#   CHECKPOINT   arrays of get_trace_state() when tracing started, restored before the seeded replay
+#   KEYSYM       a keysym's index in the pressed-set bitmask, sent the first time the key is seen
+#   TICK         tick number, pressed-set bitmask and the key-down events since the previous tick
+#   OBSERVATION  arrays of get_trace_observation() after the tick (visible cells, optionally particles)
+# Arrays are stored raw as (name, dtype, shape, bytes) entries behind a compression flag; object arrays are
+# refused, so reading a trace never unpickles anything.
+TRACE_MAGIC = 'SIMTRACE\x01';
+RECORD = struct.Struct('<BI');
+TICK = struct.Struct('<IQB');
+HEADER, MODEL, CHECKPOINT, KEYSYM, TICK_RECORD, OBSERVATION = range(1, 7);
+MAX_KEYSYMS = 64;
+# Keys that would stop or restart the trace or exit the replay are never recorded
+IGNORED_KEYSYMS = set(['z', 'Escape', 'Return']);
+
+ARRAY_ENTRY = struct.Struct('<BBBI');
+
+def pack_arrays(arrays, compress=False):
+    parts = [];
+    for name, value in sorted(arrays.items()):
+        if value is None:
+            parts.append(ARRAY_ENTRY.pack(len(name), 0, 0, 0) + name);
+            continue;
+        value = np.asarray(value);
+        if value.dtype.kind == 'O':
+            raise ValueError(name + ' is not a plain array');
+        dtype = value.dtype.str;
+        data = value.tobytes();
+        parts.append(ARRAY_ENTRY.pack(len(name), len(dtype), value.ndim, len(data)) + name + dtype
+                     + struct.pack('<' + str(value.ndim) + 'I', *value.shape) + data);
+    payload = ''.join(parts);
+    return ('\x01' + zlib.compress(payload, 1)) if compress else '\x00' + payload;
+
+def unpack_arrays(payload):
+    payload = zlib.decompress(payload[1:]) if payload[0] == '\x01' else payload[1:];
+    arrays = {};
+    offset = 0;
+    while offset < len(payload):
+        name_length, dtype_length, ndim, size = ARRAY_ENTRY.unpack_from(payload, offset);
+        offset += ARRAY_ENTRY.size;
+        name = payload[offset:offset + name_length];
+        offset += name_length;
+        if not dtype_length:
+            arrays[name] = None;
+            continue;
+        dtype = np.dtype(payload[offset:offset + dtype_length]);
+        offset += dtype_length;
+        if dtype.kind == 'O':
+            raise ValueError(name + ' is not a plain array');
+        shape = struct.unpack_from('<' + str(ndim) + 'I', payload, offset);
+        offset += 4 * ndim;
+        arrays[name] = np.frombuffer(payload[offset:offset + size], dtype=dtype).reshape(shape).copy();
+        offset += size;
+    return arrays;
+
+def get_class_path(simulation):
+    module = simulation.__class__.__module__;
+    if module == '__main__':
+        module = os.path.splitext(os.path.basename(sys.modules['__main__'].__file__))[0];
+    return module + '.' + simulation.__class__.__name__;
+
+class TraceWriter:
+    
+    def __init__(self, path, simulation, options=None, visible=True, particles=False, particle_interval=10, seed=None):
+        self.path = path;
+        self.visible = visible;
+        self.particles = particles;
+        self.particle_interval = particle_interval;
+        self.seed = np.random.RandomState().randint(1 << 31) if seed is None else seed;
+        self.keysyms = {};
+        self.downs = [];
+        self.ticks = 0;
+        self.file = open(path, 'wb');
+        self.file.write(TRACE_MAGIC);
+        model = getattr(simulation, 'location_encoding_model', None);
+        tiled = isinstance(model, TiledModel);
+        self.write(HEADER, json.dumps({'simulation': get_class_path(simulation),
+                                       'width': simulation.width,
+                                       'height': simulation.height,
+                                       'rotation': getattr(simulation, 'initial_rotation', 0),
+                                       'options': options or {},
+                                       'seed': self.seed,
+                                       'tick_rate': simulation.TICK_RATE,
+                                       'visible': visible,
+                                       'particles': particles,
+                                       'particle_interval': particle_interval,
+                                       'threaded': getattr(simulation, 'mcl_worker', None) is not None,
+                                       'tiled_model': dict(model.get_options(), n=model.n, m=model.m) if tiled else None,
+                                       'created': time.time()}));
+        if model is not None and not tiled:
+            self.write(MODEL, zlib.compress(self.get_model_bytes(model)));
+        self.write(CHECKPOINT, pack_arrays(simulation.get_trace_state(), compress=True));
+        # Seeding after the checkpoint lets the replay restore and seed in the same order
+        simulation.seed_random(self.seed);
+    
+    def get_model_bytes(self, model):
+        handle, path = tempfile.mkstemp(suffix='.lem');
+        os.close(handle);
+        try:
+            model.save(path);
+            with open(path, 'rb') as f:
+                return f.read();
+        finally:
+            os.remove(path);
+    
+    def write(self, kind, payload):
+        self.file.write(RECORD.pack(kind, len(payload)));
+        self.file.write(payload);
+    
+    def get_keysym_index(self, keysym):
+        if keysym not in self.keysyms:
+            if len(self.keysyms) >= MAX_KEYSYMS:
+                raise ValueError('Traces record at most ' + str(MAX_KEYSYMS) + ' distinct keys');
+            self.keysyms[keysym] = len(self.keysyms);
+            self.write(KEYSYM, struct.pack('<B', self.keysyms[keysym]) + keysym);
+        return self.keysyms[keysym];
+    
+    def key_down(self, keysym):
+        if keysym not in IGNORED_KEYSYMS:
+            self.downs.append(self.get_keysym_index(keysym));
+    
+    def tick(self, pressed_set):
+        mask = 0;
+        for keysym in pressed_set:
+            if keysym not in IGNORED_KEYSYMS:
+                mask |= 1 << self.get_keysym_index(keysym);
+        self.write(TICK_RECORD, TICK.pack(self.ticks, mask, len(self.downs)) + struct.pack('<' + str(len(self.downs)) + 'B', *self.downs));
+        self.downs = [];
+        self.ticks += 1;
+    
+    def observe(self, simulation):
+        particles = self.particles and (self.ticks - 1) % self.particle_interval == 0;
+        if not self.visible and not particles:
+            return;
+        observation = simulation.get_trace_observation(particles);
+        if not self.visible:
+            observation.pop('visible', None);
+        self.write(OBSERVATION, pack_arrays(observation, compress=particles));
+    
+    def get_size(self):
+        return self.file.tell();
+    
+    def close(self):
+        self.file.close();
+
+class Trace:
+    
+    def __init__(self, path):
+        self.path = path;
+        self.header = None;
+        self.model_bytes = None;
+        self.checkpoint = None;
+        self.ticks = [];
+        self.observations = {};
+        keysyms = {};
+        with open(path, 'rb') as f:
+            if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+                raise ValueError(path + ' is not a simulation trace');
+            while True:
+                head = f.read(RECORD.size);
+                if len(head) < RECORD.size:
+                    break;
+                kind, length = RECORD.unpack(head);
+                payload = f.read(length);
+                if len(payload) < length:
+                    # A run that was killed mid-write leaves a truncated last record
+                    break;
+                if kind == HEADER:
+                    self.header = json.loads(payload);
+                elif kind == MODEL:
+                    self.model_bytes = zlib.decompress(payload);
+                elif kind == CHECKPOINT:
+                    self.checkpoint = unpack_arrays(payload);
+                elif kind == KEYSYM:
+                    keysyms[ord(payload[0])] = payload[1:];
+                elif kind == TICK_RECORD:
+                    tick, mask, count = TICK.unpack(payload[:TICK.size]);
+                    downs = [keysyms[index] for index in struct.unpack('<' + str(count) + 'B', payload[TICK.size:])];
+                    pressed = [keysym for index, keysym in keysyms.items() if mask >> index & 1];
+                    self.ticks.append((downs, pressed));
+                elif kind == OBSERVATION:
+                    self.observations[len(self.ticks) - 1] = unpack_arrays(payload);
+    
+    def create_simulation(self):
+        module_name, _, class_name = self.header['simulation'].rpartition('.');
+        simulation_type = getattr(importlib.import_module(module_name), class_name);
+        options = dict(self.header['options']);
+        # Replays run on the calling thread so the particle updates happen in tick order
+        options.pop('threaded_mcl', None);
+        model_path = None;
+        if self.header.get('tiled_model'):
+            options['location_encoding_model'] = TiledModel(**self.header['tiled_model']);
+        if self.model_bytes is not None:
+            handle, model_path = tempfile.mkstemp(suffix='.lem');
+            with os.fdopen(handle, 'wb') as f:
+                f.write(self.model_bytes);
+            options['location_encoding_model'] = LocationEncodingModel.load(model_path);
+        simulation = simulation_type(self.header['width'], self.header['height'], self.header['rotation'], headless=True, **options);
+        if model_path is not None:
+            # The memmap keeps the data reachable after the name is gone
+            os.remove(model_path);
+        simulation.set_trace_state(self.checkpoint);
+        simulation.seed_random(self.header['seed']);
+        return simulation;
+
+def compare_observations(recorded, replayed):
+    # Returns the names that differ and the largest absolute difference among numeric arrays of equal shape
+    differing = [];
+    largest = 0.0;
+    for name, expected in recorded.items():
+        actual = replayed.get(name);
+        if expected is None or actual is None:
+            if expected is not actual:
+                differing.append(name);
+            continue;
+        actual = np.asarray(actual).astype(expected.dtype);
+        if actual.shape != expected.shape:
+            differing.append(name);
+        elif not np.array_equal(actual, expected):
+            differing.append(name);
+            if expected.dtype.kind == 'f':
+                largest = max(largest, float(np.abs(actual.astype(float) - expected).max()));
+    return differing, largest;
+
+def replay(path, compare=True, render=False, profile=True, profile_stream=None):
+    trace = Trace(path);
+    simulation = trace.create_simulation();
+    if render:
+        simulation.init_offscreen_canvas();
+    if profile:
+        simulation.set_profiling(True);
+        if profile_stream is not None:
+            simulation.profiler.open_stream(profile_stream);
+    divergences = [];
+    largest = 0.0;
+    start = time.time();
+    for tick, (downs, pressed) in enumerate(trace.ticks):
+        for keysym in downs:
+            # F only toggles profiling, which would switch the replay's own profile off
+            if profile and keysym == 'f':
+                continue;
+            simulation.press(keysym);
+        simulation.step(pressed);
+        if render:
+            simulation.render_frame();
+        if compare and tick in trace.observations:
+            recorded = trace.observations[tick];
+            differing, difference = compare_observations(recorded, simulation.get_trace_observation('positions' in recorded));
+            largest = max(largest, difference);
+            if differing:
+                divergences.append((tick, differing));
+    elapsed = time.time() - start;
+    simulation.profiler.tick();
+    simulation.profiler.close_stream();
+    return {'trace': trace,
+            'simulation': simulation,
+            'ticks': len(trace.ticks),
+            'elapsed': elapsed,
+            'compared': len(trace.observations) if compare else 0,
+            'divergences': divergences,
+            'largest_difference': largest};
+
+def print_info(trace):
+    header = trace.header;
+    print trace.path + ': ' + header['simulation'] + ' ' + str(header['width']) + ' x ' + str(header['height']) + ', seed ' + str(header['seed']);
+    print (str(len(trace.ticks)) + ' ticks (' + str(round(len(trace.ticks) / float(header['tick_rate']), 1)) + 's at ' + str(header['tick_rate']) + ' Hz), '
+           + str(len(trace.observations)) + ' observations, ' + str(os.path.getsize(trace.path) / 1024) + 'KB');
+    if header['options']:
+        print 'Options: ' + json.dumps(header['options']);
+    if header['threaded']:
+        print 'Recorded with a threaded MCL worker, particle states may not replay exactly';
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or replay a simulation trace headlessly at maximum speed');
+    parser.add_argument('path');
+    parser.add_argument('--info', action='store_true', help='only describe the trace');
+    parser.add_argument('--no-compare', dest='compare', action='store_false', help='skip comparing against recorded observations');
+    parser.add_argument('--render', action='store_true', help='also render every tick to an offscreen canvas');
+    parser.add_argument('--profile-stream', help='write per-tick phase timings to this .csv or .jsonl file');
+    args = parser.parse_args();
+    
+    if args.info:
+        print_info(Trace(args.path));
+        return;
+    result = replay(args.path, args.compare, args.render, profile_stream=args.profile_stream);
+    print_info(result['trace']);
+    print ('Replayed ' + str(result['ticks']) + ' ticks in ' + str(round(result['elapsed'], 2)) + 's ('
+           + str(int(result['ticks'] / max(result['elapsed'], 1e-9))) + ' ticks/s)');
+    if args.compare:
+        divergences = result['divergences'];
+        if not divergences:
+            print 'All ' + str(result['compared']) + ' recorded observations match';
+        else:
+            tick, names = divergences[0];
+            print (str(len(divergences)) + ' of ' + str(result['compared']) + ' observations differ, first at tick ' + str(tick)
+                   + ' (' + ', '.join(names) + '), largest difference ' + str(result['largest_difference']));
+    print '\n'.join(result['simulation'].profiler.get_status());
+    if args.compare and result['divergences']:
+        sys.exit(1);
+
+if __name__ == '__main__':
+    main();